@@ -0,0 +1,172 @@
+# answer_cache.py
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryAnswerBackend:
+    """
+    In-process LRU store with per-entry expiry
+    """
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteAnswerBackend:
+    """
+    SQLite store so several worker processes on one host can share answers
+    """
+    def __init__(self, path='answer_cache.sqlite3', max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE answers SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(value)
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now)
+            )
+            # Drop expired rows, then the least recently used beyond the size bound
+            self._conn.execute("DELETE FROM answers WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN ("
+                "SELECT key FROM answers ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+
+class RedisAnswerBackend:
+    """
+    Store backed by any Redis-protocol server (Redis, Valkey, KeyDB, ...)
+    so app workers on different hosts can share hits. Size is bounded by the
+    server's maxmemory eviction policy.
+    """
+    def __init__(self, url='redis://localhost:6379/0', prefix='vqa:answer:'):
+        import redis  # Optional dependency, only needed for this backend
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self._client.set(self.prefix + key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def clear(self):
+        for key in self._client.scan_iter(match=self.prefix + '*'):
+            self._client.delete(key)
+
+
+class AnswerCache:
+    """
+    Memoizes model answers keyed on (image content hash, normalized question,
+    model fingerprint). Values are small dicts such as {'answer': ..., 'confidence': ...}.
+    """
+    def __init__(self, backend=None, ttl=3600):
+        self.backend = backend if backend is not None else MemoryAnswerBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image_hash, normalized_question, model_fingerprint=''):
+        key = f"{model_fingerprint}\x00{image_hash}\x00{normalized_question}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, image_hash, normalized_question, model_fingerprint=''):
+        try:
+            value = self.backend.get(self.make_key(image_hash, normalized_question, model_fingerprint))
+        except Exception as e:
+            # A broken shared backend should never fail the request
+            logger.warning("Answer cache lookup failed: %s", e)
+            value = None
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, image_hash, normalized_question, value, model_fingerprint=''):
+        try:
+            self.backend.set(self.make_key(image_hash, normalized_question, model_fingerprint), value, self.ttl)
+        except Exception as e:
+            logger.warning("Answer cache store failed: %s", e)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
\ No newline at end of file
@@ -1,8 +1,5 @@
 # app.py
 import streamlit as st
-import os
-from PIL import Image
-import tempfile
 import sys
 import numpy as np
 
@@ -11,6 +8,8 @@ sys.path.append('.')
 
 # Import your VQA system
 from vqa_system import VQASystem
+from image_io import ingest_image, image_content_hash
+from telemetry import configure_logging
 
 # Set page configuration
 st.set_page_config(
@@ -20,10 +19,16 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+@st.cache_resource(show_spinner=False)
+def load_vqa_system():
+    """Build the VQA system once per process; reruns and sessions share it"""
+    configure_logging()  # Pipeline diagnostics go to the console through logging
+    return VQASystem(warmup=True)
+
 def initialize_vqa_system():
     """Initialize the VQA system"""
     try:
-        return VQASystem()  # ← REMOVED the use_rule_based parameter
+        return load_vqa_system()  # Failures aren't cached, so the next rerun retries
     except Exception as e:
         st.error(f"Error initializing VQA system: {e}")
         return None
@@ -94,22 +99,19 @@ def main():
     # Display uploaded image
     if uploaded_file is not None:
         try:
-            # Save uploaded file to temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                temp_image_path = tmp_file.name
-
-            # Display image
-            image = Image.open(uploaded_file)
+            # Decode the upload once, in place and at bounded resolution; the
+            # same pixels are displayed and passed through the whole pipeline
+            image_hash = image_content_hash(uploaded_file.getbuffer())
+            image, original_shape = ingest_image(uploaded_file)
             st.image(image, caption="Uploaded Image", use_column_width=True)
             
-            st.success(f"✅ Image uploaded successfully! Size: {image.size}")
+            st.success(f"✅ Image uploaded successfully! Size: {(original_shape[1], original_shape[0])}")
 
         except Exception as e:
             st.error(f"Error processing image: {e}")
-            temp_image_path = None
+            image = None
     else:
-        temp_image_path = None
+        image = None
         st.info("👆 Please upload an image to get started")
 
     # Question section
@@ -149,11 +151,12 @@ def main():
     )
 
     # Results section
-    if process_clicked and temp_image_path and question.strip():
+    if process_clicked and image is not None and question.strip():
         with st.spinner("🤔 Analyzing image and processing question..."):
             try:
                 # Process the question
-                results = vqa_system.process_input(temp_image_path, question)
+                results = vqa_system.process_input(image, question, image_hash=image_hash,
+                                                   shape=original_shape)
                 
                 st.markdown("---")
                 st.markdown("### 📋 Analysis Results")
@@ -189,13 +192,6 @@ def main():
                 st.error(f"Error processing your request: {e}")
                 st.info("Please try a different image or question.")
 
-        # Clean up temporary file
-        try:
-            if temp_image_path and os.path.exists(temp_image_path):
-                os.unlink(temp_image_path)
-        except:
-            pass
-
     # Footer
     st.markdown("---")
     st.markdown(
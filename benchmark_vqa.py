@@ -0,0 +1,400 @@
+# benchmark_vqa.py
+"""
+Performance benchmarks for each stage of the VQA pipeline.
+
+    python benchmark_vqa.py --output baseline.json
+    python benchmark_vqa.py --compare baseline.json --threshold 0.1
+
+Inputs are synthetic images (several resolutions, encoded as JPEG/PNG/WebP)
+and a fixed question set, all generated from a seed so runs are comparable
+across machines and commits. Every stage reports latency percentiles,
+throughput, the peak RSS while the stage ran and how much resident memory
+it left behind (Linux only; None elsewhere). --compare exits with
+status 1 when any case's median latency regressed by more than --threshold.
+
+    python benchmark_vqa.py --stages precision --fixtures pairs.jsonl
+
+compares int8 and bf16 ViLT answers and latency against fp32.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from image_io import load_image, load_image_reduced
+
+STAGES = ('decode', 'analysis', 'text', 'vilt', 'end_to_end', 'precision')
+# 'precision' loads ViLT once per precision, so it only runs when asked for
+DEFAULT_STAGES = ('decode', 'analysis', 'text', 'vilt', 'end_to_end')
+DEFAULT_RESOLUTIONS = ((640, 480), (1920, 1080), (4000, 3000))
+DEFAULT_FORMATS = ('jpeg', 'png', 'webp')
+DEFAULT_BATCH_SIZES = (1, 4, 8, 16)
+
+QUESTIONS = [
+    "What color is the car?",
+    "How many people are in the picture?",
+    "Is there a dog in the image?",
+    "Where is the cat sitting?",
+    "What is the man holding?",
+    "Describe the scene in this image",
+    "Are there any trees near the building?",
+    "What does the sign say?",
+    "What colour are the flowers on the table?",
+    "Does the woman have an umbrella?",
+    "Which location is this photo taken in?",
+    "Why is the street wet?",
+]
+
+
+def synthetic_image(width, height, seed=0):
+    """
+    Gradient background with random rectangles and sensor-like noise, so
+    edge detection, color clustering and compression all have real work
+    """
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.empty((height, width, 3), dtype=np.float32)
+    image[..., 0] = x
+    image[..., 1] = y
+    image[..., 2] = (x + y) / 2
+    for _ in range(12):
+        x0, y0 = rng.randint(0, width - 1), rng.randint(0, height - 1)
+        x1 = min(width, x0 + rng.randint(width // 20 + 1, width // 3 + 2))
+        y1 = min(height, y0 + rng.randint(height // 20 + 1, height // 3 + 2))
+        image[y0:y1, x0:x1] = rng.randint(0, 256, size=3)
+    image += rng.normal(0, 6, size=image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def encode_image(pixels, image_format):
+    buffer = io.BytesIO()
+    options = {'quality': 90} if image_format in ('jpeg', 'webp') else {}
+    Image.fromarray(pixels).save(buffer, format=image_format.upper(), **options)
+    return buffer.getvalue()
+
+
+def build_inputs(resolutions=DEFAULT_RESOLUTIONS, formats=DEFAULT_FORMATS, seed=0):
+    """
+    Return {'WxH': pixels} and {'WxH.format': encoded_bytes}
+    """
+    decoded = {}
+    encoded = {}
+    for width, height in resolutions:
+        name = f"{width}x{height}"
+        decoded[name] = synthetic_image(width, height, seed)
+        for image_format in formats:
+            encoded[f"{name}.{image_format}"] = encode_image(decoded[name], image_format)
+    return decoded, encoded
+
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets the peak RSS (VmHWM) on Linux 4.0+, so
+    # each stage reports its own peak instead of the process's high-water mark
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """
+    Peak RSS since the last reset_peak_rss(), or None where /proc isn't available
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return round(pages * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0), 1)
+
+
+def measure(fn, repeats=20, warmup=2, items=1):
+    """
+    Time fn() repeats times after warmup calls and summarize the latencies.
+    items is how many inputs one call processes, for throughput.
+    """
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings = np.array(timings)
+    return {
+        'p50_ms': round(float(np.percentile(timings, 50)), 3),
+        'p95_ms': round(float(np.percentile(timings, 95)), 3),
+        'p99_ms': round(float(np.percentile(timings, 99)), 3),
+        'mean_ms': round(float(timings.mean()), 3),
+        'items_per_sec': round(items * 1000.0 / max(float(timings.mean()), 1e-9), 2),
+        'repeats': repeats
+    }
+
+
+def bench_decode(decoded, encoded, repeats, analysis_max_side=512):
+    results = {}
+    for name, data in encoded.items():
+        results[f"{name}/full"] = measure(lambda: load_image(data), repeats)
+        results[f"{name}/reduced_{analysis_max_side}"] = measure(
+            lambda: load_image_reduced(data, analysis_max_side), repeats
+        )
+    return results
+
+
+def bench_analysis(decoded, encoded, repeats):
+    from utils.image_processor import ImageProcessor, ANALYSES
+
+    processor = ImageProcessor()
+    results = {}
+    for name, pixels in decoded.items():
+        for analysis in ANALYSES:
+            results[f"{name}/{analysis}"] = measure(
+                lambda: processor.simple_image_analysis(pixels, analyses=(analysis,)), repeats
+            )
+        results[f"{name}/all"] = measure(lambda: processor.simple_image_analysis(pixels), repeats)
+    return results
+
+
+def question_log(size, seed=0):
+    """
+    A synthetic query log: the benchmark questions with varied subjects, so
+    it has many repeats but also many distinct questions
+    """
+    rng = np.random.RandomState(seed)
+    subjects = [f"object {i}" for i in range(max(1, size // 100))]
+    templates = QUESTIONS + [
+        "How many {} are there?", "What color is the {}?", "Is there a {} here?",
+        "Where is the {}?", "What does the {} look like?"
+    ]
+    picks = rng.randint(0, len(templates), size=size)
+    subject_picks = rng.randint(0, len(subjects), size=size)
+    return [templates[t].format(subjects[s]) for t, s in zip(picks, subject_picks)]
+
+
+def bench_text(decoded, encoded, repeats, log_size=1000000):
+    from utils.text_processor import TextProcessor
+
+    processor = TextProcessor()
+    count = len(QUESTIONS)
+    log = question_log(log_size)
+    # The log is mostly repeats, which classify_batch answers from a dict;
+    # its distinct questions time the regex itself
+    distinct = list(dict.fromkeys(log))
+    return {
+        'identify_question_type': measure(
+            lambda: [processor.identify_question_type(q) for q in QUESTIONS], repeats, items=count
+        ),
+        f'identify_question_types/log_{log_size}': measure(
+            lambda: processor.identify_question_types(log), min(repeats, 3), warmup=0, items=log_size
+        ),
+        f'identify_question_type/distinct_{len(distinct)}': measure(
+            lambda: [processor.identify_question_type(q) for q in distinct], min(repeats, 3),
+            warmup=0, items=len(distinct)
+        ),
+        'extract_keywords': measure(
+            lambda: [processor.extract_keywords(q) for q in QUESTIONS], repeats, items=count
+        )
+    }
+
+
+def bench_vilt(decoded, encoded, repeats, batch_sizes=DEFAULT_BATCH_SIZES):
+    from models.vqa_model import RealVQAModel
+
+    model = RealVQAModel(max_batch_size=max(batch_sizes))
+    model.load()
+    results = {}
+    for name, pixels in decoded.items():
+        results[f"preprocess/{name}"] = measure(
+            lambda: model.processor.image_processor(pixels, return_tensors="pt"), repeats
+        )
+
+    # Forward passes use one image (served from the pixel cache after warm-up)
+    # so only tokenization, padding and the model itself are timed
+    pixels = decoded[sorted(decoded)[0]]
+    for batch_size in batch_sizes:
+        pairs = [(pixels, QUESTIONS[i % len(QUESTIONS)]) for i in range(batch_size)]
+        results[f"forward/batch_{batch_size}"] = measure(
+            lambda: model.predict_batch(pairs), repeats, items=batch_size
+        )
+    return results
+
+
+def bench_end_to_end(decoded, encoded, repeats):
+    from vqa_system import VQASystem
+
+    # No answer cache, so every call runs the model
+    system = VQASystem(use_answer_cache=False, warmup=True)
+    results = {}
+    for name, data in encoded.items():
+        results[name] = measure(lambda: system.process_input(data, QUESTIONS[0]), repeats)
+    return results
+
+
+def bench_precision(decoded, encoded, repeats, batch_sizes=DEFAULT_BATCH_SIZES, fixtures=None):
+    """
+    Answer agreement and latency of int8/bf16 ViLT against fp32. fixtures is
+    a JSONL/CSV file of image/question records; by default the synthetic
+    images are paired with every benchmark question.
+    """
+    from models.vqa_model import compare_precisions
+
+    if fixtures:
+        from record_io import read_records
+        pairs = [(load_image(record['image']), record['question']) for record in read_records(fixtures)]
+    else:
+        pairs = [(pixels, question) for pixels in decoded.values() for question in QUESTIONS]
+    return compare_precisions(pairs, max_batch_size=max(batch_sizes))
+
+
+BENCHMARKS = {
+    'decode': bench_decode,
+    'analysis': bench_analysis,
+    'text': bench_text,
+    'vilt': bench_vilt,
+    'end_to_end': bench_end_to_end,
+    'precision': bench_precision,
+}
+
+
+def environment():
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+    }
+    try:
+        import torch
+        info['torch'] = torch.__version__
+        info['torch_threads'] = torch.get_num_threads()
+    except ImportError:
+        info['torch'] = None
+    return info
+
+
+def run_benchmarks(stages=DEFAULT_STAGES, resolutions=DEFAULT_RESOLUTIONS, formats=DEFAULT_FORMATS,
+                   repeats=20, batch_sizes=DEFAULT_BATCH_SIZES, seed=0, fixtures=None):
+    """
+    Run the selected stages and return a JSON-serializable report
+    """
+    decoded, encoded = build_inputs(resolutions, formats, seed)
+    report = {
+        'environment': environment(),
+        'config': {
+            'stages': list(stages),
+            'resolutions': [f"{w}x{h}" for w, h in resolutions],
+            'formats': list(formats),
+            'repeats': repeats,
+            'batch_sizes': list(batch_sizes),
+            'seed': seed
+        },
+        'stages': {}
+    }
+
+    for stage in stages:
+        print(f"Benchmarking {stage}...")
+        kwargs = {}
+        if stage in ('vilt', 'precision'):
+            kwargs['batch_sizes'] = batch_sizes
+        if stage == 'precision':
+            kwargs['fixtures'] = fixtures
+        peak_reset = reset_peak_rss()
+        rss_before = current_rss_mb()
+        try:
+            cases = BENCHMARKS[stage](decoded, encoded, repeats, **kwargs)
+        except ImportError as e:
+            print(f"  skipped: {e}")
+            continue
+        rss_after = current_rss_mb()
+        report['stages'][stage] = {
+            'cases': cases,
+            'peak_rss_mb': peak_rss_mb() if peak_reset else None,
+            'rss_delta_mb': round(rss_after - rss_before, 1) if rss_before is not None else None
+        }
+        for case, summary in cases.items():
+            if 'p50_ms' not in summary:
+                print(f"  {case:<32} {summary}")
+                continue
+            print(f"  {case:<32} p50 {summary['p50_ms']:>9.2f} ms  p95 {summary['p95_ms']:>9.2f} ms  "
+                  f"{summary['items_per_sec']:>9.1f}/s")
+    return report
+
+
+def compare_reports(current, baseline, threshold=0.1):
+    """
+    Compare median latencies case by case. Returns a list of
+    (stage, case, baseline_ms, current_ms, change) for cases slower than
+    baseline by more than threshold (a fraction).
+    """
+    regressions = []
+    for stage, stage_report in current['stages'].items():
+        baseline_cases = baseline.get('stages', {}).get(stage, {}).get('cases', {})
+        for case, summary in stage_report['cases'].items():
+            if case not in baseline_cases or 'p50_ms' not in summary:
+                continue
+            before = baseline_cases[case]['p50_ms']
+            after = summary['p50_ms']
+            change = (after - before) / max(before, 1e-9)
+            if change > threshold:
+                regressions.append((stage, case, before, after, change))
+    return regressions
+
+
+def _parse_resolution(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the VQA pipeline stage by stage")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(DEFAULT_STAGES))
+    parser.add_argument('--resolutions', nargs='+', type=_parse_resolution, default=list(DEFAULT_RESOLUTIONS),
+                        help="e.g. 640x480 1920x1080")
+    parser.add_argument('--formats', nargs='+', choices=DEFAULT_FORMATS, default=list(DEFAULT_FORMATS))
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=list(DEFAULT_BATCH_SIZES))
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fixtures', help="Image/question JSONL or CSV for the precision stage")
+    parser.add_argument('--output', help="Write the report to this JSON file")
+    parser.add_argument('--compare', help="Baseline report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Allowed median latency increase before a case counts as a regression")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.stages, args.resolutions, args.formats, args.repeats,
+                            args.batch_sizes, args.seed, args.fixtures)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.threshold)
+        for stage, case, before, after, change in regressions:
+            print(f"REGRESSION {stage}/{case}: {before:.2f} ms -> {after:.2f} ms ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions over {args.threshold:.0%} against {args.compare}")
\ No newline at end of file
@@ -0,0 +1,335 @@
+# corpus_index.py
+"""
+Ask the same questions over a whole image corpus.
+
+    python corpus_index.py build data/images index/catalog
+    python corpus_index.py query index/catalog answers.jsonl -q "Is there a person in this image?"
+
+build runs ViLT's image preprocessing (bounded decode, resize, normalize)
+once per image and stores the processed pixel tensors in append-only shard
+files, memory-mapped at query time. Re-running build on a grown image set
+only processes the new images.
+
+query streams (image, question) batches over the stored tensors through
+batched ViLT forward passes, so no image is decoded or preprocessed again.
+Results are appended to a JSONL file as each batch finishes; --resume
+continues an interrupted run, and picks up images added to the index since.
+
+An index is a directory of shard-NNNNN.bin files (each tensor stored
+unpadded, in its own height and width, float16 by default) and index.json
+(image key -> shard, offset and size, plus the preprocessing fingerprint).
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from feature_cache import config_fingerprint
+from feature_store import list_images
+from image_io import INGEST_MAX_SIDE, ingest_image
+from record_io import JsonlWriter, write_json_atomic
+
+DEFAULT_SHARD_BYTES = 1 << 30
+
+
+def preprocessing_fingerprint(processor, dtype):
+    """
+    Fingerprint of everything that decides the stored tensors; an index can
+    only be queried by a model whose preprocessing matches it
+    """
+    from models.vqa_model import VILT_MODEL_NAME
+
+    return config_fingerprint({
+        'model': VILT_MODEL_NAME,
+        'image_processor': processor.image_processor.to_dict(),
+        'ingest_max_side': INGEST_MAX_SIDE,
+        'dtype': dtype
+    })
+
+
+class CorpusIndex:
+    """
+    Processed ViLT pixel tensors in append-only shard files plus a JSON
+    index. Shards are memory-mapped on first read; get() returns views.
+    """
+    def __init__(self, path, writable=False):
+        self.path = path
+        with open(os.path.join(path, 'index.json'), encoding='utf-8') as f:
+            index = json.load(f)
+        self.dtype = np.dtype(index['dtype'])
+        self.fingerprint = index['fingerprint']
+        self.shard_bytes = index['shard_bytes']
+        self.shards = index['shards']
+        self.rows = index['rows']
+        self.failed = index.get('failed', {})
+        self._maps = {}
+        self._file = None
+
+        if writable:
+            # Drop bytes an interrupted build wrote past the last flushed index
+            for number, size in enumerate(self.shards):
+                with open(self._shard_path(number), 'r+b') as f:
+                    f.truncate(size)
+
+    @classmethod
+    def create(cls, path, fingerprint, dtype='float16', shard_bytes=DEFAULT_SHARD_BYTES):
+        os.makedirs(path, exist_ok=True)
+        write_json_atomic(os.path.join(path, 'index.json'), {
+            'dtype': np.dtype(dtype).name, 'fingerprint': fingerprint,
+            'shard_bytes': shard_bytes, 'shards': [], 'rows': {}, 'failed': {}
+        })
+        return cls(path, writable=True)
+
+    @classmethod
+    def open_or_create(cls, path, fingerprint, dtype='float16', shard_bytes=DEFAULT_SHARD_BYTES):
+        if os.path.exists(os.path.join(path, 'index.json')):
+            index = cls(path, writable=True)
+            if index.fingerprint != fingerprint:
+                raise ValueError(f"{path} was built with different ViLT preprocessing; rebuild it")
+            return index
+        return cls.create(path, fingerprint, dtype, shard_bytes)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def keys(self):
+        """
+        Image keys in the order they were added (new images come last)
+        """
+        return list(self.rows)
+
+    def get(self, key):
+        """
+        The processed 3 x H x W pixel tensor for key, as a view into the
+        mapped shard
+        """
+        shard, offset, height, width = self.rows[key]
+        start = offset // self.dtype.itemsize
+        count = 3 * height * width
+        mapped = self._maps.get(shard)
+        if mapped is None or mapped.shape[0] < start + count:
+            # Map the shard (again, if it grew since it was mapped)
+            mapped = self._maps[shard] = np.memmap(self._shard_path(shard), dtype=self.dtype, mode='r',
+                                                   shape=(self.shards[shard] // self.dtype.itemsize,))
+        return mapped[start:start + count].reshape(3, height, width)
+
+    def pixel_inputs(self, key):
+        """
+        The {'pixel_values', 'pixel_mask'} dict RealVQAModel batches, in float32
+        """
+        values = torch.from_numpy(self.get(key).astype(np.float32))
+        return {
+            'pixel_values': values,
+            'pixel_mask': torch.ones(values.shape[1:], dtype=torch.long)
+        }
+
+    def write(self, key, pixel_values):
+        """
+        Append one processed 3 x H x W tensor; call flush() to make it durable
+        """
+        data = np.ascontiguousarray(pixel_values, dtype=self.dtype).tobytes()
+        full = self.shards and self.shards[-1] and self.shards[-1] + len(data) > self.shard_bytes
+        if not self.shards or full:
+            if self._file is not None:
+                self._file.close()
+            self.shards.append(0)
+            self._file = open(self._shard_path(len(self.shards) - 1), 'wb')
+        elif self._file is None:
+            # Resume appending to the last shard
+            self._file = open(self._shard_path(len(self.shards) - 1), 'ab')
+        shard = len(self.shards) - 1
+        self._file.write(data)
+        self.rows[key] = [shard, self.shards[shard], int(pixel_values.shape[1]), int(pixel_values.shape[2])]
+        self.shards[shard] += len(data)
+
+    def mark_failed(self, key, error):
+        self.failed[key] = error
+
+    def flush(self):
+        # Sync the shard before the index that refers to its new bytes
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        write_json_atomic(os.path.join(self.path, 'index.json'), {
+            'dtype': self.dtype.name, 'fingerprint': self.fingerprint,
+            'shard_bytes': self.shard_bytes, 'shards': self.shards,
+            'rows': self.rows, 'failed': self.failed
+        })
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _shard_path(self, number):
+        return os.path.join(self.path, f"shard-{number:05d}.bin")
+
+
+def _preprocess(processor, path):
+    pixels, _ = ingest_image(path)
+    return processor.image_processor(pixels, return_tensors='np')['pixel_values'][0]
+
+
+def build_index(source, index_path, model=None, dtype='float16', workers=4, flush_every=256,
+                shard_bytes=DEFAULT_SHARD_BYTES):
+    """
+    Preprocess every image in source (a directory or manifest, as for
+    feature_store) into the index at index_path, skipping images it already
+    has. Images that fail to decode are recorded in the index's 'failed' map.
+    """
+    if model is None:
+        from models.vqa_model import RealVQAModel
+        model = RealVQAModel()
+    processor = model.processor
+
+    entries = list_images(source)
+    index = CorpusIndex.open_or_create(index_path, preprocessing_fingerprint(processor, np.dtype(dtype).name),
+                                       dtype, shard_bytes)
+    pending = [(key, path) for key, path in entries if key not in index and key not in index.failed]
+    print(f"{len(entries)} images, {len(entries) - len(pending)} already indexed, {len(pending)} to add")
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='vqa-index') as executor:
+            # Bounded look-ahead: at most a few chunks of decoded images in memory
+            for start in range(0, len(pending), flush_every):
+                chunk = pending[start:start + flush_every]
+                futures = [(key, executor.submit(_preprocess, processor, path)) for key, path in chunk]
+                for key, future in futures:
+                    try:
+                        index.write(key, future.result())
+                    except Exception as e:
+                        print(f"Failed to load {key}: {e}")
+                        index.mark_failed(key, f"{type(e).__name__}: {e}")
+                index.flush()
+                print(f"{len(index)}/{len(entries)} images indexed")
+    finally:
+        index.flush()
+        index.close()
+
+    print(f"Done: {len(index)} images in index, {len(index.failed)} failed")
+    return index
+
+
+def _load_query_checkpoint(path, questions):
+    questions_fingerprint = config_fingerprint({'questions': list(questions)})
+    if not os.path.exists(path):
+        return {'processed': 0, 'questions': questions_fingerprint, 'seconds': 0.0}
+    with open(path, encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint['questions'] != questions_fingerprint:
+        raise ValueError(f"{path} is from a run with different questions; drop --resume to start over")
+    return checkpoint
+
+
+def query_index(index_path, questions, output_path, model=None, batch_size=32, resume=False, limit=None):
+    """
+    Answer every question about every indexed image, writing one JSONL row
+    per (image, question) as each batch finishes. Pairs run image by image,
+    in index order, so the questions about an image share its padded size;
+    resume continues after the last checkpointed pair (including any
+    images added to the index since). Returns a summary with pairs/sec.
+    """
+    if model is None:
+        from models.vqa_model import RealVQAModel
+        model = RealVQAModel(max_batch_size=batch_size)
+
+    index = CorpusIndex(index_path)
+    if preprocessing_fingerprint(model.processor, index.dtype.name) != index.fingerprint:
+        raise ValueError(f"{index_path} was built with different ViLT preprocessing; rebuild it")
+
+    questions = list(questions)
+    checkpoint_path = output_path + '.checkpoint.json'
+    checkpoint = _load_query_checkpoint(checkpoint_path if resume else '', questions)
+    pairs = ((key, question) for key in index.keys() for question in questions)
+    pairs = itertools.islice(pairs, checkpoint['processed'], limit)
+
+    writer = JsonlWriter(output_path, append=resume and checkpoint['processed'] > 0,
+                         offset=checkpoint.get('output_offset'))
+    start = time.perf_counter()
+    processed_this_run = 0
+    try:
+        while True:
+            batch = list(itertools.islice(pairs, batch_size))
+            if not batch:
+                break
+            # Each image's tensor is read and converted once per batch
+            pixel_inputs = {key: index.pixel_inputs(key) for key, _ in batch}
+            try:
+                predictions = model.predict_pixel_batch([pixel_inputs[key] for key, _ in batch],
+                                                        [question for _, question in batch])
+                errors = [None] * len(batch)
+            except Exception as e:
+                print(f"Batch failed: {e}")
+                predictions = [None] * len(batch)
+                errors = [f"{type(e).__name__}: {e}"] * len(batch)
+
+            writer.write([
+                {
+                    'image': key,
+                    'question': question,
+                    'answer': prediction['answer'] if prediction else None,
+                    'confidence': prediction['confidence'] if prediction else None,
+                    'error': error
+                }
+                for (key, question), prediction, error in zip(batch, predictions, errors)
+            ])
+            checkpoint['processed'] += len(batch)
+            checkpoint['seconds'] += time.perf_counter() - start
+            start = time.perf_counter()
+            processed_this_run += len(batch)
+            # Rows first; a resumed run truncates the output to this offset
+            checkpoint['output_offset'] = writer.commit()
+            write_json_atomic(checkpoint_path, checkpoint)
+    finally:
+        writer.close()
+
+    seconds = max(checkpoint['seconds'], 1e-9)
+    return {
+        'images': len(index),
+        'questions': len(questions),
+        'pairs': checkpoint['processed'],
+        'pairs_this_run': processed_this_run,
+        'pairs_per_sec': round(checkpoint['processed'] / seconds, 2)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute ViLT image inputs for a corpus and query them")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help="Add a directory's or manifest's images to an index")
+    build.add_argument('source', help="Image directory or manifest file")
+    build.add_argument('index', help="Index directory")
+    build.add_argument('--dtype', choices=['float16', 'float32'], default='float16')
+    build.add_argument('--workers', type=int, default=4, help="Image decode/preprocess threads")
+
+    query = commands.add_parser('query', help="Answer questions over every indexed image")
+    query.add_argument('index', help="Index directory")
+    query.add_argument('output', help="Output .jsonl file")
+    query.add_argument('-q', '--question', action='append', default=[], help="Question (repeatable)")
+    query.add_argument('--questions-file', help="File with one question per line")
+    query.add_argument('--batch-size', type=int, default=32)
+    query.add_argument('--resume', action='store_true', help="Continue from the last checkpoint")
+    query.add_argument('--limit', type=int, default=None, help="Stop after this many pairs")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_index(args.source, args.index, dtype=args.dtype, workers=args.workers)
+    else:
+        questions = list(args.question)
+        if args.questions_file:
+            from utils.text_processor import read_questions
+            questions.extend(read_questions(args.questions_file))
+        if not questions:
+            parser.error("no questions given")
+        summary = query_index(args.index, questions, args.output, batch_size=args.batch_size,
+                              resume=args.resume, limit=args.limit)
+        print(json.dumps(summary, indent=2))
\ No newline at end of file
@@ -0,0 +1,252 @@
+# dominant_colors.py
+"""
+Fast dominant-color detection.
+
+The original detector ran cv2.kmeans (10 attempts, 20 iterations) over every
+pixel of the full-resolution image. DominantColorEngine downscales and
+subsamples first, then clusters with one of:
+
+    'exact'      cv2.kmeans over all pixels (the original behavior)
+    'kmeans'     cv2.kmeans over the subsample
+    'minibatch'  mini-batch k-means over the subsample
+    'histogram'  quantized color histogram, clustered by weighted k-means
+
+All methods are deterministic for a given seed. Run this module to compare
+each method's speed and color error against the original output.
+"""
+import argparse
+import itertools
+import time
+
+import cv2
+import numpy as np
+
+from image_io import downscale
+
+# Accuracy budgets map to a method and sampling settings
+ACCURACY_PRESETS = {
+    'fast': {'method': 'histogram', 'max_side': 128, 'max_pixels': 16384},
+    'balanced': {'method': 'minibatch', 'max_side': 256, 'max_pixels': 20000},
+    'high': {'method': 'kmeans', 'max_side': 512, 'max_pixels': 100000},
+    'exact': {'method': 'exact', 'max_side': None, 'max_pixels': None},
+}
+
+
+def sample_pixels(image, max_pixels, rng):
+    """
+    Flatten image to an (N, 3) float32 array of at most max_pixels pixels
+    """
+    pixels = image.reshape(-1, 3)
+    if max_pixels and len(pixels) > max_pixels:
+        pixels = pixels[rng.choice(len(pixels), max_pixels, replace=False)]
+    return np.float32(pixels)
+
+
+def _assign(pixels, centers):
+    distances = ((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=-1)
+    return distances.argmin(axis=1)
+
+
+def _kmeans_plusplus(pixels, k, rng, weights=None):
+    probabilities = weights / weights.sum() if weights is not None else None
+    centers = [pixels[rng.choice(len(pixels), p=probabilities)]]
+    for _ in range(1, k):
+        distances = ((pixels[:, None, :] - np.array(centers)[None]) ** 2).sum(axis=-1).min(axis=1)
+        if weights is not None:
+            distances = distances * weights
+        total = distances.sum()
+        if total == 0:
+            centers.append(centers[-1])
+            continue
+        centers.append(pixels[rng.choice(len(pixels), p=distances / total)])
+    return np.array(centers, dtype=np.float32)
+
+
+def _proportions(labels, k, weights=None):
+    counts = np.bincount(labels, weights=weights, minlength=k).astype(np.float64)
+    return counts / max(counts.sum(), 1e-12)
+
+
+def cv2_kmeans_colors(pixels, k, seed, attempts=10, max_iter=20):
+    """
+    The original cv2.kmeans detector, seeded for reproducibility
+    """
+    cv2.setRNGSeed(seed)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, max_iter, 1.0)
+    _, labels, centers = cv2.kmeans(pixels, k, None, criteria, attempts, cv2.KMEANS_RANDOM_CENTERS)
+    return centers, _proportions(labels.ravel(), k)
+
+
+def minibatch_kmeans_colors(pixels, k, rng, batch_size=1024, max_iter=100, tol=0.5, deadline=None):
+    """
+    Mini-batch k-means (Sculley 2010) with k-means++ initialization.
+    Stops on convergence, after max_iter batches, or when deadline passes.
+    """
+    centers = _kmeans_plusplus(pixels[rng.choice(len(pixels), min(len(pixels), 4096), replace=False)], k, rng)
+    counts = np.zeros(k)
+
+    for _ in range(max_iter):
+        batch = pixels[rng.randint(0, len(pixels), size=min(batch_size, len(pixels)))]
+        labels = _assign(batch, centers)
+        previous = centers.copy()
+        for j in range(k):
+            members = batch[labels == j]
+            if len(members):
+                counts[j] += len(members)
+                centers[j] += (len(members) / counts[j]) * (members.mean(axis=0) - centers[j])
+        if np.abs(centers - previous).max() < tol:
+            break
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+
+    return centers, _proportions(_assign(pixels, centers), k)
+
+
+def histogram_colors(pixels, k, rng, bins=16, max_iter=10):
+    """
+    Quantize colors into bins**3 cells, then run weighted k-means over the
+    occupied cells' mean colors
+    """
+    step = 256 // bins
+    quantized = (pixels // step).astype(np.int64)
+    cell = (quantized[:, 0] * bins + quantized[:, 1]) * bins + quantized[:, 2]
+    counts = np.bincount(cell, minlength=bins ** 3)
+    occupied = np.nonzero(counts)[0]
+    weights = counts[occupied].astype(np.float64)
+    means = np.stack([
+        np.bincount(cell, weights=pixels[:, c], minlength=bins ** 3)[occupied] for c in range(3)
+    ], axis=1) / weights[:, None]
+    means = np.float32(means)
+
+    if len(occupied) <= k:
+        centers = np.zeros((k, 3), dtype=np.float32)
+        centers[:len(occupied)] = means
+        centers[len(occupied):] = means[0]
+        labels = np.arange(len(occupied))
+        return centers, _proportions(labels, k, weights)
+
+    centers = _kmeans_plusplus(means, k, rng, weights)
+    for _ in range(max_iter):
+        labels = _assign(means, centers)
+        previous = centers.copy()
+        for j in range(k):
+            member = labels == j
+            if member.any():
+                centers[j] = np.average(means[member], axis=0, weights=weights[member])
+        if np.abs(centers - previous).max() < 0.5:
+            break
+
+    return centers, _proportions(_assign(means, centers), k, weights)
+
+
+class DominantColorEngine:
+    """
+    Configurable dominant-color detector. Pick an accuracy preset ('fast',
+    'balanced', 'high', 'exact') or set method/max_side/max_pixels directly;
+    time_budget_ms bounds the mini-batch iterations.
+    """
+    def __init__(self, accuracy='balanced', method=None, max_side=None, max_pixels=None,
+                 seed=0, time_budget_ms=None):
+        preset = ACCURACY_PRESETS[accuracy]
+        self.method = method or preset['method']
+        self.max_side = max_side if max_side is not None else preset['max_side']
+        self.max_pixels = max_pixels if max_pixels is not None else preset['max_pixels']
+        self.seed = seed
+        self.time_budget_ms = time_budget_ms
+
+    def analyze(self, image, k=3):
+        """
+        Return (centers, proportions): k integer colors in the image's channel
+        order, sorted by the share of pixels they cover
+        """
+        start = time.perf_counter()
+        rng = np.random.RandomState(self.seed)
+
+        if self.method == 'exact':
+            centers, proportions = cv2_kmeans_colors(np.float32(image.reshape(-1, 3)), k, self.seed)
+        else:
+            pixels = sample_pixels(downscale(image, self.max_side), self.max_pixels, rng)
+            if self.method == 'kmeans':
+                centers, proportions = cv2_kmeans_colors(pixels, k, self.seed, attempts=3)
+            elif self.method == 'minibatch':
+                deadline = start + self.time_budget_ms / 1000.0 if self.time_budget_ms else None
+                centers, proportions = minibatch_kmeans_colors(pixels, k, rng, deadline=deadline)
+            elif self.method == 'histogram':
+                centers, proportions = histogram_colors(pixels, k, rng)
+            else:
+                raise ValueError(f"Unknown dominant color method: {self.method}")
+
+        order = np.argsort(-proportions, kind='stable')
+        return np.rint(centers[order]).astype(int), proportions[order]
+
+    def detect(self, image, k=3):
+        return self.analyze(image, k)[0]
+
+
+def color_error(centers, reference):
+    """
+    Mean Euclidean distance between two sets of colors under the best
+    one-to-one matching
+    """
+    centers = np.asarray(centers, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    best = None
+    for permutation in itertools.permutations(range(len(reference))):
+        error = np.linalg.norm(centers - reference[list(permutation)], axis=1).mean()
+        best = error if best is None else min(best, error)
+    return best
+
+
+def compare_with_reference(image, k=3, engines=None, repeats=3):
+    """
+    Time each engine on image and measure its color error against the
+    original full-resolution cv2.kmeans output
+    """
+    reference_engine = DominantColorEngine('exact')
+    start = time.perf_counter()
+    reference = reference_engine.detect(image, k)
+    reference_ms = (time.perf_counter() - start) * 1000
+
+    engines = engines or {name: DominantColorEngine(name) for name in ('fast', 'balanced', 'high')}
+    report = {'exact': {'ms': round(reference_ms, 2), 'error': 0.0}}
+    for name, engine in engines.items():
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            centers = engine.detect(image, k)
+            timings.append((time.perf_counter() - start) * 1000)
+        report[name] = {
+            'ms': round(float(np.median(timings)), 2),
+            'speedup': round(reference_ms / max(float(np.median(timings)), 1e-6), 1),
+            'error': round(float(color_error(centers, reference)), 2)
+        }
+    return report
+
+
+def _synthetic_image(height, width, seed=0):
+    rng = np.random.RandomState(seed)
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    # Three color regions plus noise, so the reference clusters are well defined
+    image[:, :width // 3] = (200, 40, 40)
+    image[:, width // 3:2 * width // 3] = (40, 160, 60)
+    image[:, 2 * width // 3:] = (30, 60, 190)
+    noise = rng.randint(-20, 21, size=image.shape)
+    return np.clip(image.astype(int) + noise, 0, 255).astype(np.uint8)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark dominant-color engines against cv2.kmeans")
+    parser.add_argument('images', nargs='*', help="Image files (default: synthetic 12MP image)")
+    parser.add_argument('-k', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.images:
+        from image_io import load_image
+        inputs = [(path, load_image(path)) for path in args.images]
+    else:
+        inputs = [('synthetic 4000x3000', _synthetic_image(3000, 4000))]
+
+    for name, image in inputs:
+        print(f"{name}:")
+        for engine_name, result in compare_with_reference(image, args.k).items():
+            print(f"  {engine_name:>9}: {result}")
\ No newline at end of file
@@ -0,0 +1,283 @@
+# evaluate_vqa.py
+"""
+Offline bulk VQA scoring.
+
+    python evaluate_vqa.py pairs.jsonl results.jsonl --batch-size 32 --workers 8
+    python evaluate_vqa.py pairs.csv results.parquet --resume
+
+Input records (JSONL or CSV) need 'image' and 'question' columns, and may
+have 'id' and a ground-truth 'answer' (or JSONL 'answers': a list of human
+answers, scored with the VQA accuracy metric). Records are streamed, images
+are read and decoded on a thread pool ahead of the model, and results are
+written as each batch finishes. --resume continues from the checkpoint left
+by an interrupted run, even a killed one: output written after the last
+checkpoint is dropped and redone.
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from feature_cache import hash_image_bytes
+from image_io import load_image
+from record_io import JsonlWriter, ground_truth, read_records, write_json_atomic
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_ARTICLES = re.compile(r"\b(a|an|the)\b")
+_NUMBER_WORDS = {
+    'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5',
+    'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10'
+}
+
+
+def normalize_answer(answer):
+    """
+    Simplified VQA answer normalization: lowercase, drop punctuation and
+    articles, map number words to digits
+    """
+    answer = _PUNCTUATION.sub('', str(answer).lower())
+    answer = _ARTICLES.sub(' ', answer)
+    return ' '.join(_NUMBER_WORDS.get(word, word) for word in answer.split())
+
+
+def vqa_accuracy(prediction, answers):
+    """
+    VQA accuracy: min(#humans that gave the answer / 3, 1), averaged over
+    the leave-one-out subsets of the human answers. A single ground-truth
+    answer reduces to exact match.
+    """
+    prediction = normalize_answer(prediction)
+    answers = [normalize_answer(a) for a in answers]
+    if len(answers) == 1:
+        return float(prediction == answers[0])
+
+    scores = []
+    for i in range(len(answers)):
+        others = answers[:i] + answers[i + 1:]
+        scores.append(min(1.0, sum(a == prediction for a in others) / 3.0))
+    return sum(scores) / len(scores)
+
+
+def _read_image(path):
+    # Read the bytes once: they give the content hash and the decoded pixels
+    with open(path, 'rb') as f:
+        data = f.read()
+    return load_image(data), hash_image_bytes(data)
+
+
+def _batches(records, batch_size):
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def prefetched_batches(records, batch_size, executor, image_root='', depth=2):
+    """
+    Yield (batch, images) with each batch's images already decoding on the
+    thread pool while earlier batches run through the model
+    """
+    pending = deque()
+    for batch in _batches(records, batch_size):
+        futures = {}
+        for record in batch:
+            path = os.path.join(image_root, record['image'])
+            if path not in futures:
+                futures[path] = executor.submit(_read_image, path)
+        pending.append((batch, futures))
+        if len(pending) > depth:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+class ParquetWriter:
+    """
+    Writes Parquet part files into the output directory, one row group per
+    batch (pyarrow is only needed for this format). A part is only readable
+    once its footer is written, so commit() closes the current part and
+    returns the number of complete parts to checkpoint; a resumed writer
+    opened with that count deletes any later, unfinished parts.
+    """
+    def __init__(self, path, append, offset=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._pq = pq
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        existing = sorted(name for name in os.listdir(path) if name.endswith('.parquet'))
+        if not append:
+            offset = 0
+        elif offset is None:
+            offset = len(existing)
+        for name in existing[offset:]:
+            os.remove(os.path.join(path, name))
+        self.parts = offset
+        # Fixed schema: batches where no row is scored would otherwise infer null columns
+        self.schema = pa.schema([
+            ('id', pa.string()), ('image', pa.string()), ('question', pa.string()),
+            ('answer', pa.string()), ('confidence', pa.float64()), ('error', pa.string()),
+            ('accuracy', pa.float64())
+        ])
+        self._writer = None
+
+    def _part_path(self, number):
+        return os.path.join(self.path, f"part-{number:05d}.parquet")
+
+    def write(self, rows):
+        rows = [dict(row, id=None if row['id'] is None else str(row['id'])) for row in rows]
+        table = self._pa.Table.from_pylist(rows, schema=self.schema)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self._part_path(self.parts), self.schema)
+        self._writer.write_table(table)
+
+    def commit(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            with open(self._part_path(self.parts), 'rb') as f:
+                os.fsync(f.fileno())
+            self.parts += 1
+        return self.parts
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def _load_checkpoint(path):
+    if not os.path.exists(path):
+        return {'processed': 0, 'scored': 0, 'accuracy_sum': 0.0, 'images': 0, 'seconds': 0.0}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _commit(writer, checkpoint, checkpoint_path):
+    # Output first, then the checkpoint that counts it
+    checkpoint['output_offset'] = writer.commit()
+    write_json_atomic(checkpoint_path, checkpoint)
+
+
+def evaluate(input_path, output_path, model=None, batch_size=32, workers=8, image_root='',
+             output_format=None, resume=False, limit=None, checkpoint_rows=2048):
+    """
+    Score every record in input_path and write predictions to output_path.
+    Progress is checkpointed about every checkpoint_rows records (for
+    Parquet, each checkpoint also completes a part file); a killed run
+    redoes at most the records since its last checkpoint. Returns the
+    summary dict (accuracy, pairs/sec, images/sec).
+    """
+    if model is None:
+        from models.vqa_model import RealVQAModel
+        model = RealVQAModel(max_batch_size=batch_size)
+
+    output_format = output_format or ('parquet' if output_path.endswith('.parquet') else 'jsonl')
+    checkpoint_path = output_path.rstrip('/') + '.checkpoint.json'
+    checkpoint = _load_checkpoint(checkpoint_path) if resume else _load_checkpoint('')
+
+    records = read_records(input_path)
+    # Records are consumed in order, so resuming means skipping what's done
+    records = itertools.islice(records, checkpoint['processed'], limit)
+
+    writer_class = ParquetWriter if output_format == 'parquet' else JsonlWriter
+    writer = writer_class(output_path, append=resume and checkpoint['processed'] > 0,
+                          offset=checkpoint.get('output_offset'))
+
+    start = time.perf_counter()
+    uncommitted = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='vqa-decode') as executor:
+            for batch, futures in prefetched_batches(records, batch_size, executor, image_root):
+                images = {}
+                for path, future in futures.items():
+                    try:
+                        images[path] = future.result()
+                    except Exception as e:
+                        print(f"Failed to load {path}: {e}")
+
+                pairs = []
+                for record in batch:
+                    path = os.path.join(image_root, record['image'])
+                    if path in images:
+                        pixels, image_hash = images[path]
+                        pairs.append((pixels, record['question'], image_hash))
+                predictions = iter(model.predict_batch(pairs))
+
+                rows = []
+                for record in batch:
+                    path = os.path.join(image_root, record['image'])
+                    prediction = next(predictions) if path in images else None
+                    if prediction is None:
+                        error = 'image could not be loaded'
+                    else:
+                        # Failed forward passes are reported, not scored as wrong answers
+                        error = prediction.get('error')
+                        if error is not None:
+                            prediction = None
+                    row = {
+                        'id': record.get('id'),
+                        'image': record['image'],
+                        'question': record['question'],
+                        'answer': prediction['answer'] if prediction else None,
+                        'confidence': prediction['confidence'] if prediction else None,
+                        'error': error,
+                        'accuracy': None
+                    }
+                    truth = ground_truth(record)
+                    if truth is not None and prediction is not None:
+                        row['accuracy'] = vqa_accuracy(prediction['answer'], truth)
+                        checkpoint['scored'] += 1
+                        checkpoint['accuracy_sum'] += row['accuracy']
+                    rows.append(row)
+
+                writer.write(rows)
+                checkpoint['processed'] += len(batch)
+                checkpoint['images'] += len(images)
+                checkpoint['seconds'] += time.perf_counter() - start
+                start = time.perf_counter()
+                uncommitted += len(batch)
+                if uncommitted >= checkpoint_rows:
+                    _commit(writer, checkpoint, checkpoint_path)
+                    uncommitted = 0
+        if uncommitted:
+            _commit(writer, checkpoint, checkpoint_path)
+    finally:
+        writer.close()
+
+    seconds = max(checkpoint['seconds'], 1e-9)
+    summary = {
+        'pairs': checkpoint['processed'],
+        'scored': checkpoint['scored'],
+        'accuracy': round(100.0 * checkpoint['accuracy_sum'] / checkpoint['scored'], 2) if checkpoint['scored'] else None,
+        'pairs_per_sec': round(checkpoint['processed'] / seconds, 2),
+        'images_per_sec': round(checkpoint['images'] / seconds, 2)
+    }
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Batch-score VQA pairs from JSONL/CSV")
+    parser.add_argument('input', help="JSONL or CSV file of image/question[/answer] records")
+    parser.add_argument('output', help="Output .jsonl file or .parquet directory")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=8, help="Image decode threads")
+    parser.add_argument('--image-root', default='', help="Directory image paths are relative to")
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], default=None)
+    parser.add_argument('--resume', action='store_true', help="Continue from the last checkpoint")
+    parser.add_argument('--limit', type=int, default=None, help="Stop after this many records")
+    parser.add_argument('--checkpoint-rows', type=int, default=2048,
+                        help="Records between checkpoints (and Parquet part files)")
+    args = parser.parse_args()
+
+    summary = evaluate(args.input, args.output, batch_size=args.batch_size, workers=args.workers,
+                       image_root=args.image_root, output_format=args.format,
+                       resume=args.resume, limit=args.limit, checkpoint_rows=args.checkpoint_rows)
+    print(json.dumps(summary, indent=2))
\ No newline at end of file
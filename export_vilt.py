@@ -0,0 +1,147 @@
+# export_vilt.py
+"""
+Export the ViLT VQA model for graph-optimized runtimes.
+
+    python export_vilt.py exports/vilt                 # ONNX
+    python export_vilt.py exports/vilt --quantize      # + dynamic int8 ONNX
+    python export_vilt.py exports/vilt --torchscript   # + TorchScript
+
+The export directory is self-contained: the graph(s), the model config
+(id2label) and the processor, whose resize/normalize settings are the
+preprocessing the graph expects. RealVQAModel(backend='onnx',
+onnx_path='exports/vilt') serves it with ONNX Runtime on CPU.
+
+Batch, sequence length and image height/width are dynamic axes. Each
+export is checked against the eager model on a sample input and the
+maximum logit difference is printed.
+"""
+import argparse
+import os
+
+import numpy as np
+import torch
+from transformers import ViltForQuestionAnswering, ViltProcessor
+
+from models.vqa_model import VILT_MODEL_NAME
+
+INPUT_NAMES = ['input_ids', 'attention_mask', 'token_type_ids', 'pixel_values', 'pixel_mask']
+DYNAMIC_AXES = {
+    'input_ids': {0: 'batch', 1: 'sequence'},
+    'attention_mask': {0: 'batch', 1: 'sequence'},
+    'token_type_ids': {0: 'batch', 1: 'sequence'},
+    'pixel_values': {0: 'batch', 2: 'height', 3: 'width'},
+    'pixel_mask': {0: 'batch', 1: 'height', 2: 'width'},
+    'logits': {0: 'batch'}
+}
+ONNX_FILE = 'model.onnx'
+ONNX_INT8_FILE = 'model.int8.onnx'
+TORCHSCRIPT_FILE = 'model.torchscript.pt'
+
+
+def sample_inputs(processor, batch_size=2):
+    """
+    Processor output for a batch of synthetic images and questions of
+    different lengths, used for tracing and parity checks
+    """
+    rng = np.random.RandomState(0)
+    images = [rng.randint(0, 256, size=(480, 640, 3), dtype=np.uint8) for _ in range(batch_size)]
+    questions = ["What color is the car?", "How many people are standing next to the red bus?"]
+    questions = (questions * batch_size)[:batch_size]
+    encoding = processor(images, questions, padding=True, return_tensors='pt')
+    return {name: encoding[name] for name in INPUT_NAMES}
+
+
+def export_onnx(model, inputs, output_dir, opset=17):
+    path = os.path.join(output_dir, ONNX_FILE)
+    # Tracing can't run under inference_mode (it produces inference tensors)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dict(inputs),),
+            path,
+            input_names=INPUT_NAMES,
+            output_names=['logits'],
+            dynamic_axes=DYNAMIC_AXES,
+            opset_version=opset,
+            do_constant_folding=True
+        )
+    return path
+
+
+def quantize_onnx(output_dir):
+    """
+    Dynamic int8 quantization of the exported graph's weights
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    path = os.path.join(output_dir, ONNX_INT8_FILE)
+    quantize_dynamic(os.path.join(output_dir, ONNX_FILE), path, weight_type=QuantType.QInt8)
+    return path
+
+
+def export_torchscript(output_dir, inputs):
+    # TorchScript tracing needs the model built with torchscript=True (tuple outputs)
+    model = ViltForQuestionAnswering.from_pretrained(VILT_MODEL_NAME, torchscript=True)
+    model.eval()
+    path = os.path.join(output_dir, TORCHSCRIPT_FILE)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example_kwarg_inputs=dict(inputs), strict=False)
+    traced.save(path)
+    return path
+
+
+def onnx_logits(path, inputs):
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+    feed = {name: inputs[name].numpy() for name in INPUT_NAMES}
+    return session.run(['logits'], feed)[0]
+
+
+def export(output_dir, torchscript=False, quantize=False, opset=17):
+    """
+    Write the ONNX graph (and optionally an int8 ONNX graph and a
+    TorchScript module) plus config and processor to output_dir, and
+    return {export: max_abs_logit_difference_vs_eager}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    processor = ViltProcessor.from_pretrained(VILT_MODEL_NAME)
+    model = ViltForQuestionAnswering.from_pretrained(VILT_MODEL_NAME)
+    model.eval()
+    processor.save_pretrained(output_dir)
+    model.config.save_pretrained(output_dir)
+
+    inputs = sample_inputs(processor)
+    with torch.inference_mode():
+        reference = model(**inputs).logits.numpy()
+
+    differences = {}
+    path = export_onnx(model, inputs, output_dir, opset)
+    differences['onnx'] = float(np.abs(onnx_logits(path, inputs) - reference).max())
+    print(f"Wrote {path}")
+
+    if quantize:
+        path = quantize_onnx(output_dir)
+        differences['onnx_int8'] = float(np.abs(onnx_logits(path, inputs) - reference).max())
+        print(f"Wrote {path}")
+
+    if torchscript:
+        path = export_torchscript(output_dir, inputs)
+        with torch.inference_mode():
+            traced_logits = torch.jit.load(path)(**inputs)[0].numpy()
+        differences['torchscript'] = float(np.abs(traced_logits - reference).max())
+        print(f"Wrote {path}")
+
+    return differences
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export ViLT VQA to ONNX / TorchScript")
+    parser.add_argument('output_dir')
+    parser.add_argument('--torchscript', action='store_true', help="Also write a traced TorchScript module")
+    parser.add_argument('--quantize', action='store_true', help="Also write a dynamic int8 ONNX graph")
+    parser.add_argument('--opset', type=int, default=17)
+    args = parser.parse_args()
+
+    for name, difference in export(args.output_dir, args.torchscript, args.quantize, args.opset).items():
+        print(f"{name}: max |logit - eager logit| = {difference:.5f}")
\ No newline at end of file
@@ -0,0 +1,277 @@
+# fast_path.py
+"""
+Early-exit answers from the cheap image analysis.
+
+Some questions can be answered from what simple_image_analysis already
+computes, without a ViLT forward pass:
+
+    'color'       "what color is ...?" when one dominant color covers most
+                  of the image
+    'brightness'  "is it dark?" / "is the room bright?" when the mean
+                  brightness is clearly dark or clearly bright
+
+Each answerer is off unless enabled, and answers only when its guard
+holds; otherwise the question goes to ViLT as usual. Plug it in as
+HybridVQAModel's cheap_model (VQASystem does that from VQA_FAST_PATH, e.g.
+VQA_FAST_PATH=color,brightness).
+
+Validate before enabling an answerer:
+
+    python fast_path.py pairs.jsonl --image-root images/ --enable color,brightness
+
+reports, per answerer, how often it answers, how often it agrees with
+ViLT, its accuracy against ground truth when the records have answers, and
+the latency of both paths.
+"""
+import argparse
+import colorsys
+import json
+import os
+import re
+import time
+
+FAST_PATH_TYPES = ('color', 'brightness')
+
+# Yes/no questions about the whole scene's lighting, e.g. "is it dark?",
+# "is the room bright?", "was this taken at night?"
+BRIGHTNESS_PATTERN = re.compile(
+    r"^\s*(?:is|was)\s+(?:it|this|(?:this|the)\s+(?:image|picture|photo|room|scene|sky))\s+"
+    r"(?:(?:taken\s+)?(?:at|during)\s+)?(?:the\s+)?"
+    r"(?P<word>dark|dim|night|nighttime|bright|light|sunny|day|daytime)\s*\??\s*$",
+    re.IGNORECASE
+)
+DARK_WORDS = frozenset({'dark', 'dim', 'night', 'nighttime'})
+
+
+def color_name(rgb):
+    """
+    Basic color name for an RGB color, in the VQA answer vocabulary
+    """
+    hue, saturation, value = colorsys.rgb_to_hsv(*(channel / 255.0 for channel in rgb))
+    hue *= 360
+    if value < 0.2:
+        return 'black'
+    if saturation < 0.15:
+        return 'white' if value > 0.85 else 'gray'
+    if hue < 15 or hue >= 345:
+        return 'pink' if saturation < 0.4 and value > 0.7 else 'red'
+    if hue < 40:
+        return 'brown' if value < 0.6 else 'orange'
+    if hue < 70:
+        return 'yellow'
+    if hue < 170:
+        return 'green'
+    if hue < 260:
+        return 'blue'
+    if hue < 290:
+        return 'purple'
+    return 'pink'
+
+
+class FastPathAnswerer:
+    """
+    Cheap answers for the enabled question kinds, with accuracy guards:
+    min_color_share is the share of the image the dominant color must
+    cover; dark_max / bright_min are the mean brightness (0-255) at or
+    below which an image is dark, and at or above which it is bright.
+    Called as cheap_model(image_analysis, question, question_type, image);
+    returns a result dict or None. These guards are the only gate:
+    HybridVQAModel serves every answer they let through, so
+    compare_with_vilt measures exactly what is served.
+    """
+    guarded = True
+
+    def __init__(self, enabled=FAST_PATH_TYPES, min_color_share=0.75, dark_max=50.0, bright_min=190.0):
+        unknown = set(enabled) - set(FAST_PATH_TYPES)
+        if unknown:
+            raise ValueError(f"Unknown fast path types {sorted(unknown)}, expected some of {FAST_PATH_TYPES}")
+        self.enabled = tuple(enabled)
+        self.min_color_share = min_color_share
+        self.dark_max = dark_max
+        self.bright_min = bright_min
+
+    @classmethod
+    def from_env(cls):
+        """
+        The answerer configured by VQA_FAST_PATH (comma-separated types), or
+        None when it is unset
+        """
+        enabled = [name.strip() for name in os.environ.get('VQA_FAST_PATH', '').split(',') if name.strip()]
+        return cls(enabled) if enabled else None
+
+    def kind(self, question, question_type):
+        """
+        Which fast path answerer, if any, handles this question
+        """
+        if question_type == 'color':
+            return 'color'
+        if BRIGHTNESS_PATTERN.match(question):
+            return 'brightness'
+        return None
+
+    def handles(self, question, question_type):
+        """
+        True when an enabled answerer may answer this question (so the
+        caller should have the image analysis ready)
+        """
+        return self.kind(question, question_type) in self.enabled
+
+    def __call__(self, image_analysis, question, question_type, image=None):
+        kind = self.kind(question, question_type)
+        if kind not in self.enabled:
+            return None
+        if kind == 'color':
+            return self.answer_color(image_analysis)
+        return self.answer_brightness(image_analysis, question)
+
+    def answer_color(self, image_analysis):
+        proportions = image_analysis.get('color_proportions')
+        if proportions is None or not len(proportions):
+            return None
+        share = float(proportions[0])
+        if share < self.min_color_share:
+            return None
+        return self._result(color_name(image_analysis['colors_detected'][0]), 100.0 * share)
+
+    def answer_brightness(self, image_analysis, question):
+        brightness = image_analysis.get('brightness')
+        match = BRIGHTNESS_PATTERN.match(question)
+        if brightness is None or match is None:
+            return None
+        if brightness <= self.dark_max:
+            is_dark = True
+            # 100 for a black image, 50 right at the guard
+            confidence = 100.0 - 50.0 * brightness / max(self.dark_max, 1e-6)
+        elif brightness >= self.bright_min:
+            is_dark = False
+            confidence = 100.0 - 50.0 * (255.0 - brightness) / max(255.0 - self.bright_min, 1e-6)
+        else:
+            return None
+        asks_dark = match.group('word').lower() in DARK_WORDS
+        return self._result('yes' if asks_dark == is_dark else 'no', confidence)
+
+    def _result(self, answer, confidence):
+        confidence = round(confidence, 2)
+        return {
+            'answer': answer,
+            'confidence': confidence,
+            'top_k': [{'answer': answer, 'confidence': confidence}],
+            'model': 'fast-path'
+        }
+
+
+def compare_with_vilt(records, answerer, model=None, image_root='', batch_size=32, limit=None):
+    """
+    Run the fast path over (image, question[, answer(s)]) records and check
+    the questions it answers against ViLT. Returns, per answerer kind, its
+    coverage, agreement with ViLT, accuracy of both against ground truth and
+    the fast path's milliseconds per question, plus ViLT's and the image
+    analysis' milliseconds per question.
+    """
+    from evaluate_vqa import normalize_answer, vqa_accuracy
+    from image_io import load_image
+    from record_io import ground_truth
+    from utils.image_processor import ImageProcessor
+    from utils.text_processor import TextProcessor
+
+    if model is None:
+        from models.vqa_model import RealVQAModel
+        model = RealVQAModel(max_batch_size=batch_size)
+    image_processor = ImageProcessor()
+    text_processor = TextProcessor()
+
+    stats = {}
+    timings = {'analysis': 0.0, 'analyzed': 0, 'vilt': 0.0, 'vilt_pairs': 0}
+    pending = []
+
+    def check_with_vilt():
+        start = time.perf_counter()
+        predictions = model.predict_batch([(image, question) for _, image, question, _, _ in pending])
+        timings['vilt'] += time.perf_counter() - start
+        timings['vilt_pairs'] += len(pending)
+        for (kind, _, _, fast_answer, truth), prediction in zip(pending, predictions):
+            entry = stats[kind]
+            entry['agree'] += normalize_answer(fast_answer) == normalize_answer(prediction['answer'])
+            if truth is not None:
+                entry['scored'] += 1
+                entry['fast_accuracy'] += vqa_accuracy(fast_answer, truth)
+                entry['vilt_accuracy'] += vqa_accuracy(prediction['answer'], truth)
+        pending.clear()
+
+    current_path = None
+    image = analysis = None
+    for count, record in enumerate(records):
+        if limit is not None and count >= limit:
+            break
+        question = record['question']
+        question_type = text_processor.identify_question_type(question)
+        kind = answerer.kind(question, question_type)
+        if kind is None:
+            continue
+
+        path = os.path.join(image_root, record['image'])
+        if path != current_path:
+            # Records are usually grouped by image; analyze each run once
+            current_path = path
+            try:
+                image = load_image(path)
+            except Exception as e:
+                print(f"Failed to load {path}: {e}")
+                image = None
+                continue
+            start = time.perf_counter()
+            analysis = image_processor.simple_image_analysis(image)
+            timings['analysis'] += time.perf_counter() - start
+            timings['analyzed'] += 1
+        if image is None:
+            continue
+
+        entry = stats.setdefault(kind, {'questions': 0, 'answered': 0, 'agree': 0, 'fast_seconds': 0.0,
+                                        'scored': 0, 'fast_accuracy': 0.0, 'vilt_accuracy': 0.0})
+        entry['questions'] += 1
+        start = time.perf_counter()
+        result = answerer(analysis, question, question_type, image)
+        entry['fast_seconds'] += time.perf_counter() - start
+        if result is not None:
+            entry['answered'] += 1
+            pending.append((kind, image, question, result['answer'], ground_truth(record)))
+            if len(pending) >= batch_size:
+                check_with_vilt()
+    if pending:
+        check_with_vilt()
+
+    report = {
+        kind: {
+            'questions': entry['questions'],
+            'coverage': round(100.0 * entry['answered'] / entry['questions'], 2),
+            'agreement': round(100.0 * entry['agree'] / entry['answered'], 2) if entry['answered'] else None,
+            'fast_accuracy': round(100.0 * entry['fast_accuracy'] / entry['scored'], 2) if entry['scored'] else None,
+            'vilt_accuracy': round(100.0 * entry['vilt_accuracy'] / entry['scored'], 2) if entry['scored'] else None,
+            'fast_ms': round(1000.0 * entry['fast_seconds'] / entry['questions'], 4)
+        }
+        for kind, entry in stats.items()
+    }
+    report['vilt_ms'] = round(1000.0 * timings['vilt'] / max(timings['vilt_pairs'], 1), 2)
+    report['image_analysis_ms'] = round(1000.0 * timings['analysis'] / max(timings['analyzed'], 1), 2)
+    return report
+
+
+if __name__ == '__main__':
+    from record_io import read_records
+
+    parser = argparse.ArgumentParser(description="Check fast path answers against ViLT")
+    parser.add_argument('input', help="JSONL or CSV file of image/question[/answer] records")
+    parser.add_argument('--image-root', default='', help="Directory image paths are relative to")
+    parser.add_argument('--enable', default=','.join(FAST_PATH_TYPES), help="Comma-separated fast path types")
+    parser.add_argument('--min-color-share', type=float, default=0.75)
+    parser.add_argument('--dark-max', type=float, default=50.0)
+    parser.add_argument('--bright-min', type=float, default=190.0)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--limit', type=int, default=None, help="Stop after this many records")
+    args = parser.parse_args()
+
+    answerer = FastPathAnswerer([name for name in args.enable.split(',') if name], args.min_color_share,
+                                args.dark_max, args.bright_min)
+    report = compare_with_vilt(read_records(args.input), answerer, image_root=args.image_root,
+                               batch_size=args.batch_size, limit=args.limit)
+    print(json.dumps(report, indent=2))
\ No newline at end of file
@@ -0,0 +1,202 @@
+# feature_cache.py
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def hash_image_bytes(data):
+    """
+    Content hash used as the cache key for an image
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_image_file(image_path, chunk_size=1 << 20):
+    """
+    Hash an image file's bytes without decoding it
+    """
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def config_fingerprint(config):
+    """
+    Stable short hash of a preprocessing config dict
+    """
+    encoded = json.dumps(config, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def estimate_nbytes(value):
+    """
+    Approximate memory held by a cached value (tensors, arrays, containers)
+    """
+    if hasattr(value, 'element_size') and hasattr(value, 'nelement'):
+        return value.element_size() * value.nelement()
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class FeatureCache:
+    """
+    Content-addressed cache for preprocessed image inputs and features.
+
+    Entries are keyed by (namespace, image content hash). Each namespace has a
+    preprocessing config; when it changes the namespace is invalidated. The
+    in-memory tier is an LRU bounded by bytes, and an optional on-disk tier
+    under disk_dir keeps entries across restarts.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, namespace, config):
+        """
+        Register the preprocessing config for a namespace, dropping any
+        entries produced under a different config
+        """
+        fingerprint = config_fingerprint(config)
+        with self._lock:
+            changed = self._fingerprints.get(namespace) != fingerprint
+            self._fingerprints[namespace] = fingerprint
+        if changed:
+            self._drop(namespace, keep_fingerprint=fingerprint)
+        return fingerprint
+
+    def get(self, namespace, image_hash):
+        key = self._key(namespace, image_hash)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._store(key, value)
+        return value
+
+    def put(self, namespace, image_hash, value):
+        key = self._key(namespace, image_hash)
+        self._store(key, value)
+        self._write_disk(key, value)
+
+    def invalidate(self, namespace=None):
+        """
+        Remove all entries, or only those of one namespace
+        """
+        self._drop(namespace)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def _key(self, namespace, image_hash):
+        return (namespace, self._fingerprints.get(namespace, 'default'), image_hash)
+
+    def _store(self, key, value):
+        size = estimate_nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+
+            # Evict least recently used entries until we fit the byte budget
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def _drop(self, namespace, keep_fingerprint=None):
+        with self._lock:
+            for key in list(self._entries):
+                if namespace is None or (key[0] == namespace and key[1] != keep_fingerprint):
+                    self.current_bytes -= self._entries.pop(key)[1]
+
+        if not self.disk_dir:
+            return
+        if namespace is not None:
+            namespaces = [namespace]
+        elif os.path.isdir(self.disk_dir):
+            namespaces = os.listdir(self.disk_dir)
+        else:
+            namespaces = []
+        for name in namespaces:
+            namespace_dir = os.path.join(self.disk_dir, name)
+            if not os.path.isdir(namespace_dir):
+                continue
+            for fingerprint in os.listdir(namespace_dir):
+                if fingerprint != keep_fingerprint:
+                    shutil.rmtree(os.path.join(namespace_dir, fingerprint), ignore_errors=True)
+
+    def _disk_path(self, key):
+        namespace, fingerprint, image_hash = key
+        return os.path.join(self.disk_dir, namespace, fingerprint, image_hash[:2], image_hash + '.pkl')
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Discarding unreadable cache entry %s: %s", path, e)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _write_disk(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temp file first so readers never see a partial entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
\ No newline at end of file
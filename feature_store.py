@@ -0,0 +1,210 @@
+# feature_store.py
+"""
+Bulk ResNet50 feature extraction into a memory-mapped feature store.
+
+    python feature_store.py data/images features/resnet50 --batch-size 64 --workers 4
+
+A store is a directory holding features.npy (an N x 2048 float32 .npy file
+that is memory-mapped, never loaded whole) and index.json (image key ->
+row). Re-running the same command resumes where the previous run stopped.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+
+from record_io import write_json_atomic
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def list_images(source):
+    """
+    Return image keys and paths from a directory (walked recursively, keys
+    relative to it) or a manifest file (one path per line, or JSONL with an
+    'image' field)
+    """
+    if os.path.isdir(source):
+        entries = []
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    entries.append((os.path.relpath(path, source), path))
+        return sorted(entries)
+
+    entries = []
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            key = json.loads(line)['image'] if source.endswith('.jsonl') else line
+            entries.append((key, key if os.path.isabs(key) else os.path.join(base, key)))
+    return entries
+
+
+class FeatureStore:
+    """
+    Memory-mapped feature matrix plus a JSON index. Open with mode='r' for
+    zero-copy reads; rows are views into the mapped file.
+    """
+    def __init__(self, path, mode='r'):
+        self.path = path
+        with open(os.path.join(path, 'index.json'), encoding='utf-8') as f:
+            index = json.load(f)
+        self.dim = index['dim']
+        self.rows = index['rows']
+        self.failed = index.get('failed', {})
+        self.features = np.load(os.path.join(path, 'features.npy'), mmap_mode=mode)
+
+    @classmethod
+    def create(cls, path, capacity, dim=2048):
+        os.makedirs(path, exist_ok=True)
+        features = np.lib.format.open_memmap(
+            os.path.join(path, 'features.npy'), mode='w+', dtype=np.float32, shape=(capacity, dim)
+        )
+        del features
+        write_json_atomic(os.path.join(path, 'index.json'), {'dim': dim, 'rows': {}, 'failed': {}})
+        return cls(path, mode='r+')
+
+    @classmethod
+    def open_or_create(cls, path, capacity, dim=2048):
+        if os.path.exists(os.path.join(path, 'index.json')):
+            store = cls(path, mode='r+')
+            store.ensure_capacity(capacity)
+            return store
+        return cls.create(path, capacity, dim)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def get(self, key):
+        """
+        Feature vector for key (a view into the mapped file), or None
+        """
+        row = self.rows.get(key)
+        return self.features[row] if row is not None else None
+
+    def keys(self):
+        return sorted(self.rows, key=self.rows.get)
+
+    def ensure_capacity(self, capacity):
+        """
+        Grow the mapped file when a resumed run has more images than it holds
+        """
+        if capacity <= self.features.shape[0]:
+            return
+        features_path = os.path.join(self.path, 'features.npy')
+        grown_path = features_path + '.grow'
+        grown = np.lib.format.open_memmap(grown_path, mode='w+', dtype=np.float32, shape=(capacity, self.dim))
+        grown[:self.features.shape[0]] = self.features
+        grown.flush()
+        del grown
+        self.features = None
+        os.replace(grown_path, features_path)
+        self.features = np.load(features_path, mmap_mode='r+')
+
+    def write(self, keys, features):
+        """
+        Append features for keys; call flush() to make them durable
+        """
+        start = len(self.rows)
+        self.features[start:start + len(keys)] = features
+        for offset, key in enumerate(keys):
+            self.rows[key] = start + offset
+
+    def mark_failed(self, key, error):
+        self.failed[key] = error
+
+    def flush(self):
+        # Data first, then the index, so the index never points at unwritten rows
+        self.features.flush()
+        write_json_atomic(os.path.join(self.path, 'index.json'),
+                          {'dim': self.dim, 'rows': self.rows, 'failed': self.failed})
+
+
+class _ImageDataset(Dataset):
+    def __init__(self, entries, transform):
+        self.entries = entries
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        key, path = self.entries[i]
+        try:
+            with Image.open(path) as image:
+                return key, self.transform(image.convert('RGB')), None
+        except Exception as e:
+            return key, None, f"{type(e).__name__}: {e}"
+
+
+def _collate(items):
+    loaded = [(key, tensor) for key, tensor, _ in items if tensor is not None]
+    failed = [(key, error) for key, _, error in items if error is not None]
+    keys = [key for key, _ in loaded]
+    tensors = torch.stack([tensor for _, tensor in loaded]) if loaded else None
+    return keys, tensors, failed
+
+
+def extract_to_store(source, store_path, image_processor=None, batch_size=64, num_workers=4,
+                     flush_every=20):
+    """
+    Extract pooled ResNet50 features for every image in source into the
+    store at store_path, skipping images the store already has. Images that
+    fail to decode are recorded in the index's 'failed' map, not dropped
+    silently.
+    """
+    if image_processor is None:
+        from utils.image_processor import ImageProcessor
+        image_processor = ImageProcessor()
+
+    entries = list_images(source)
+    store = FeatureStore.open_or_create(store_path, capacity=len(entries))
+    pending = [(key, path) for key, path in entries if key not in store and key not in store.failed]
+    # Rows for images no longer in the source stay in the store, so new
+    # rows go after all of them, not after len(entries)
+    store.ensure_capacity(len(store.rows) + len(pending))
+    print(f"{len(entries)} images, {len(entries) - len(pending)} already done, {len(pending)} to extract")
+
+    loader = DataLoader(
+        _ImageDataset(pending, image_processor.transform),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        collate_fn=_collate,
+        persistent_workers=num_workers > 0
+    )
+
+    for batch_number, (keys, tensors, failed) in enumerate(loader, start=1):
+        if tensors is not None:
+            store.write(keys, image_processor.extract_pooled_features(tensors))
+        for key, error in failed:
+            print(f"Failed to load {key}: {error}")
+            store.mark_failed(key, error)
+        if batch_number % flush_every == 0:
+            store.flush()
+            print(f"{len(store)}/{len(entries)} images extracted")
+
+    store.flush()
+    print(f"Done: {len(store)} images in store, {len(store.failed)} failed")
+    return store
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Extract ResNet50 features into a memory-mapped store")
+    parser.add_argument('source', help="Image directory or manifest file")
+    parser.add_argument('store', help="Output store directory")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    extract_to_store(args.source, args.store, batch_size=args.batch_size, num_workers=args.workers)
\ No newline at end of file
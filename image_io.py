@@ -0,0 +1,220 @@
+# image_io.py
+import hashlib
+import io
+import math
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from feature_cache import hash_image_bytes, hash_image_file
+
+# Ingestion limits: encoded upload size, pixels a decode may materialize, and
+# the longer side images are decoded to (ViLT resizes to a 384 short side,
+# at most 640 long, so 1024 keeps everything the model and analysis use)
+MAX_IMAGE_BYTES = int(os.environ.get('VQA_MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.environ.get('VQA_MAX_IMAGE_PIXELS', 40_000_000))
+INGEST_MAX_SIDE = int(os.environ.get('VQA_INGEST_MAX_SIDE', 1024))
+
+
+class ImageTooLargeError(ValueError):
+    """
+    The image is over the byte limit, or decoding it would exceed the pixel limit
+    """
+
+
+class ImageDecodeError(ValueError):
+    """
+    The data is not an image PIL can decode, or it is truncated or corrupt
+    """
+
+
+def load_image(image):
+    """
+    Decode an image source into an HxWx3 uint8 RGB array.
+
+    Accepts a file path, encoded bytes, a file-like object, a PIL image or a
+    NumPy array. Arrays that are already RGB uint8 are returned as-is, so a
+    decoded image can be passed through the whole pipeline without copies.
+    """
+    if isinstance(image, np.ndarray):
+        if image.dtype != np.uint8:
+            image = np.clip(image, 0, 255).astype(np.uint8)
+        if image.ndim == 2:
+            return np.stack([image] * 3, axis=-1)
+        if image.shape[-1] == 4:
+            return image[..., :3]
+        return image
+
+    if isinstance(image, Image.Image):
+        pil_image = image
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        pil_image = Image.open(io.BytesIO(image))
+    else:
+        pil_image = Image.open(image)
+
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    return np.asarray(pil_image)
+
+
+def downscale(image, max_side):
+    """
+    Shrink an array so its longer side is at most max_side (area interpolation)
+    """
+    if not max_side:
+        return image
+    height, width = image.shape[:2]
+    scale = max_side / float(max(height, width))
+    if scale >= 1:
+        return image
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def load_image_reduced(image, max_side):
+    """
+    Decode an image source with its longer side at most max_side and return
+    (rgb_pixels, original_shape). Encoded JPEGs are decoded straight to a
+    reduced size with PIL's draft mode (DCT scaling), so the full-resolution
+    bitmap is never materialized.
+    """
+    if isinstance(image, np.ndarray) or isinstance(image, Image.Image):
+        pixels = load_image(image)
+        return downscale(pixels, max_side), pixels.shape
+
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        pil_image = Image.open(io.BytesIO(image))
+    else:
+        pil_image = Image.open(image)
+
+    width, height = pil_image.size
+    _draft(pil_image, max_side)
+    return downscale(load_image(pil_image), max_side), (height, width, 3)
+
+
+def _draft(pil_image, max_side):
+    # JPEGs decode straight to a smaller size (DCT scaling); draft() only
+    # shrinks by powers of two, never below the requested size, and is a
+    # no-op for other formats
+    width, height = pil_image.size
+    if max_side and max(width, height) > max_side:
+        scale = max_side / float(max(width, height))
+        pil_image.draft('RGB', (math.ceil(width * scale), math.ceil(height * scale)))
+
+
+def read_limited(stream, max_bytes=MAX_IMAGE_BYTES, chunk_size=1 << 16):
+    """
+    Read a file-like upload chunk by chunk into a single buffer, failing as
+    soon as it passes max_bytes instead of buffering the whole body first
+    """
+    buffer = io.BytesIO()
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        if buffer.tell() + len(chunk) > max_bytes:
+            raise ImageTooLargeError(f"Image is larger than {max_bytes} bytes")
+        buffer.write(chunk)
+    # getvalue() hands over the buffer without copying it
+    return buffer.getvalue()
+
+
+def ingest_image(image, max_side=INGEST_MAX_SIDE, max_pixels=MAX_IMAGE_PIXELS, max_bytes=MAX_IMAGE_BYTES):
+    """
+    Decode an untrusted image source with bounded memory and return
+    (rgb_pixels, original_shape).
+
+    Encoded images (path, bytes, file-like) are checked against max_bytes,
+    and their dimensions are read from the header before anything is
+    decoded. JPEGs are decoded straight to about max_side on the longer side;
+    other formats decode at full size and are then downscaled, so the pixels
+    a decode would materialize must stay within max_pixels, or
+    ImageTooLargeError is raised; data that doesn't decode raises
+    ImageDecodeError. Decoded arrays and PIL images are already
+    in memory and are passed to load_image unchanged.
+    """
+    if isinstance(image, (np.ndarray, Image.Image)):
+        pixels = load_image(image)
+        return pixels, pixels.shape
+
+    if isinstance(image, (str, os.PathLike)):
+        size = os.path.getsize(image)
+        source = image
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        size = memoryview(image).nbytes
+        # BytesIO shares a bytes object's buffer instead of copying it
+        source = io.BytesIO(image)
+    elif hasattr(image, 'getbuffer'):
+        # In-memory uploads (BytesIO, Streamlit's UploadedFile) are read in place
+        size = image.getbuffer().nbytes
+        image.seek(0)
+        source = image
+    else:
+        source = io.BytesIO(read_limited(image, max_bytes))
+        size = source.getbuffer().nbytes
+    if size > max_bytes:
+        raise ImageTooLargeError(f"Image is {size} bytes, over the {max_bytes} byte limit")
+
+    try:
+        pil_image = Image.open(source)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    except OSError as e:
+        # UnidentifiedImageError: not a format PIL recognizes
+        raise ImageDecodeError(f"Cannot decode image: {e}") from e
+    width, height = pil_image.size
+    _draft(pil_image, max_side)
+    decoded_width, decoded_height = pil_image.size
+    if decoded_width * decoded_height > max_pixels:
+        raise ImageTooLargeError(
+            f"Decoding a {width}x{height} {pil_image.format} image needs "
+            f"{decoded_width * decoded_height} pixels, over the {max_pixels} pixel limit"
+        )
+
+    try:
+        if max_side and max(decoded_width, decoded_height) > max_side:
+            # Shrink inside PIL so the full-size bitmap isn't also copied to an array
+            if pil_image.mode != 'RGB':
+                pil_image = pil_image.convert('RGB')
+            pil_image.thumbnail((max_side, max_side), Image.BOX)
+        return load_image(pil_image), (height, width, 3)
+    except OSError as e:
+        # Truncated or corrupt image data only fails once it is decoded
+        raise ImageDecodeError(f"Cannot decode image: {e}") from e
+
+
+def image_content_hash(image):
+    """
+    Content hash of an image source. Paths, encoded bytes and file-like
+    objects are hashed over their encoded bytes without decoding; decoded
+    images are hashed over their pixels. Streams are read up to
+    MAX_IMAGE_BYTES and rewound, so they must be seekable.
+    """
+    if isinstance(image, (str, os.PathLike)):
+        return hash_image_file(image)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return hash_image_bytes(image)
+    if hasattr(image, 'getbuffer'):
+        # In-memory uploads (BytesIO, Streamlit's UploadedFile) are hashed in place
+        return hash_image_bytes(image.getbuffer())
+    if hasattr(image, 'read'):
+        if not (hasattr(image, 'seekable') and image.seekable()):
+            raise TypeError(f"Cannot hash a non-seekable {type(image).__name__} stream; read it into bytes first")
+        position = image.tell()
+        try:
+            return hash_image_bytes(read_limited(image))
+        finally:
+            image.seek(position)
+
+    if isinstance(image, Image.Image):
+        header = f"{image.mode}:{image.size}".encode('utf-8')
+        data = image.tobytes()
+    elif isinstance(image, np.ndarray):
+        pixels = np.ascontiguousarray(image)
+        header = f"{pixels.dtype}:{pixels.shape}".encode('utf-8')
+        data = pixels.data
+    else:
+        raise TypeError(f"Cannot hash an image of type {type(image).__name__}")
+
+    digest = hashlib.sha256(header)
+    digest.update(data)
+    return digest.hexdigest()
\ No newline at end of file
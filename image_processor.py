@@ -1,4 +1,7 @@
 # utils/image_processor.py
+import logging
+import threading
+import time
 import torch
 import torchvision.transforms as transforms
 from torchvision import models
@@ -6,11 +9,29 @@ from PIL import Image
 import cv2
 import numpy as np
 
+from dominant_colors import DominantColorEngine
+from feature_cache import FeatureCache
+from image_io import load_image, load_image_reduced, image_content_hash
+from model_registry import get_registry
+from telemetry import get_telemetry
+
+logger = logging.getLogger(__name__)
+
+
+def _load_resnet50():
+    model = models.resnet50(pretrained=True)
+    model.eval()  # Set to evaluation mode
+    return model
+
+ANALYSES = ('brightness', 'edges', 'colors')
+
 class ImageProcessor:
-    def __init__(self):
-        # Load pre-trained ResNet model for image features
-        self.model = models.resnet50(pretrained=True)
-        self.model.eval()  # Set to evaluation mode
+    def __init__(self, feature_cache=None, color_accuracy='balanced', analysis_max_side=512):
+        # The pre-trained ResNet model is loaded on first use, since the
+        # default pipeline only needs the OpenCV analysis
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.load_seconds = None
         
         # Image preprocessing transform
         self.transform = transforms.Compose([
@@ -21,58 +42,128 @@ class ImageProcessor:
                 std=[0.229, 0.224, 0.225]
             )
         ])
+        
+        # Dominant colors are clustered on a downscaled subsample; use
+        # color_accuracy='exact' for full-resolution cv2.kmeans
+        self.color_engine = DominantColorEngine(color_accuracy)
+        
+        # simple_image_analysis works on a copy no larger than this (0 = full size)
+        self.analysis_max_side = analysis_max_side
+        self.telemetry = get_telemetry()
+        
+        # ResNet features are cached by image content and transform config
+        self.feature_cache = feature_cache if feature_cache is not None else FeatureCache()
+        self.feature_cache.configure('resnet50', {
+            'model': 'resnet50',
+            'transform': repr(self.transform)
+        })
     
-    def extract_features(self, image_path):
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    # Shared with every other ImageProcessor in this process
+                    start = time.perf_counter()
+                    model = get_registry().get('resnet50', _load_resnet50)
+                    self.load_seconds = time.perf_counter() - start
+                    self._model = model
+        return self._model
+    
+    def extract_features(self, image, image_hash=None):
         """
-        Extract features from image using pre-trained CNN
+        Extract features from image using pre-trained CNN. image can be a
+        path, encoded bytes, a PIL image or an RGB array.
         """
         try:
+            if image_hash is None:
+                image_hash = image_content_hash(image)
+            cached = self.feature_cache.get('resnet50', image_hash)
+            if cached is not None:
+                return cached
+            
             # Load and preprocess image
-            image = Image.open(image_path).convert('RGB')
+            image = Image.fromarray(load_image(image))
             image_tensor = self.transform(image).unsqueeze(0)  # Add batch dimension
             
             # Extract features
             with torch.no_grad():
                 features = self.model(image_tensor)
             
-            return features.squeeze().numpy()
+            features = features.squeeze().numpy()
+            features.setflags(write=False)  # Shared with later cache hits
+            self.feature_cache.put('resnet50', image_hash, features)
+            return features
         
-        except Exception as e:
-            print(f"Error processing image: {e}")
+        except Exception:
+            logger.exception("Error processing image")
+            self.telemetry.increment('vqa_errors_total', stage='resnet50')
             return None
     
-    def simple_image_analysis(self, image_path):
+    def extract_pooled_features(self, image_tensors):
         """
-        Simple image analysis for demo purposes
+        Run a batch of transformed images (N x 3 x 224 x 224) through ResNet50
+        up to global average pooling and return N x 2048 features. Unlike
+        extract_features, errors propagate to the caller.
         """
-        image = cv2.imread(image_path)
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        model = self.model
+        with torch.no_grad():
+            x = model.conv1(image_tensors)
+            x = model.maxpool(model.relu(model.bn1(x)))
+            x = model.layer4(model.layer3(model.layer2(model.layer1(x))))
+            features = torch.flatten(model.avgpool(x), 1)
+        return features.numpy()
+    
+    def simple_image_analysis(self, image, analyses=ANALYSES, max_side=None, cancel=None):
+        """
+        Simple image analysis for demo purposes. image can be a path, encoded
+        bytes, a PIL image or an already-decoded RGB array.
+        
+        The image is decoded (or downscaled) once to at most max_side pixels
+        on its longer side, and brightness, edges and colors are all computed
+        from that shared copy (max_side=0 analyzes at full resolution). Pass
+        analyses to compute only some of them. When the cancel event is set,
+        the remaining analyses are skipped and the partial result returned.
+        """
+        max_side = self.analysis_max_side if max_side is None else max_side
+        telemetry = self.telemetry
+        with telemetry.span('downscale'):
+            image, shape = load_image_reduced(image, max_side)
+        
+        analysis = {'shape': shape}
+        cancelled = cancel.is_set if cancel is not None else (lambda: False)
         
-        analysis = {
-            'shape': image.shape,
-            'colors_detected': self.detect_dominant_colors(image),
-            'edges_detected': self.detect_edges(image),
-            'brightness': np.mean(image)
-        }
+        if 'brightness' in analyses and not cancelled():
+            with telemetry.span('brightness'):
+                analysis['brightness'] = float(np.mean(cv2.mean(image)[:3]))
+        
+        if 'edges' in analyses and not cancelled():
+            with telemetry.span('edges'):
+                edge_count = self.detect_edges(image)
+            # Report the count at the original resolution so it stays comparable
+            scale = (shape[0] * shape[1]) / float(image.shape[0] * image.shape[1])
+            analysis['edges_detected'] = int(round(edge_count * scale))
+            analysis['edge_density'] = edge_count / float(image.shape[0] * image.shape[1])
+        
+        if 'colors' in analyses and not cancelled():
+            with telemetry.span('colors'):
+                colors, proportions = self.color_engine.analyze(image)
+            analysis['colors_detected'] = colors
+            analysis['color_proportions'] = proportions
         
         return analysis
     
     def detect_dominant_colors(self, image, k=3):
         """
-        Simple color detection using k-means
+        Simple color detection using k-means (centers are in the image's
+        channel order, RGB for pipeline images, most common color first)
         """
-        pixels = image.reshape(-1, 3)
-        pixels = np.float32(pixels)
-        
-        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
-        _, labels, centers = cv2.kmeans(pixels, k, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
-        
-        return centers.astype(int)
+        return self.color_engine.detect(image, k)
     
     def detect_edges(self, image):
         """
-        Detect edges in image
+        Detect edges in an RGB image
         """
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
         edges = cv2.Canny(gray, 50, 150)
-        return np.sum(edges > 0)  # Count edge pixels
\ No newline at end of file
+        return cv2.countNonZero(edges)  # Count edge pixels
\ No newline at end of file
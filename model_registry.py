@@ -0,0 +1,126 @@
+# model_registry.py
+import gc
+import os
+import threading
+import time
+
+
+def _current_rss():
+    """
+    Resident set size of this process in bytes (None where /proc is unavailable)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _modules(value):
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _modules(item)
+    elif hasattr(value, 'parameters') and hasattr(value, 'buffers'):
+        yield value
+
+
+def parameter_bytes(value):
+    """
+    Bytes held by the parameters and buffers of any torch modules in value
+    """
+    total = 0
+    for module in _modules(value):
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ModelRegistry:
+    """
+    Process-wide store of loaded models. Each name is loaded once, by the
+    first caller, and every later caller gets the same shared instance.
+    Models are used read-only (eval mode, no grad), so sessions and worker
+    threads can share one copy of the weights.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._stats = {}
+        self._name_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, factory):
+        """
+        Return the model registered under name, calling factory() to load it
+        if this process hasn't loaded it yet
+        """
+        entry = self._entries.get(name)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            name_lock = self._name_locks.setdefault(name, threading.Lock())
+
+        # Only callers of the same name wait for each other while it loads
+        with name_lock:
+            if name in self._entries:
+                return self._entries[name]
+
+            rss_before = _current_rss()
+            start = time.perf_counter()
+            entry = factory()
+            load_seconds = time.perf_counter() - start
+            rss_after = _current_rss()
+
+            self._stats[name] = {
+                'load_seconds': round(load_seconds, 4),
+                'parameter_bytes': parameter_bytes(entry),
+                'rss_delta_bytes': rss_after - rss_before if rss_before is not None and rss_after is not None else None
+            }
+            self._entries[name] = entry
+            return entry
+
+    def is_loaded(self, name):
+        return name in self._entries
+
+    def memory_report(self):
+        """
+        Per-model load time and memory, plus the current process RSS
+        """
+        return {
+            'models': {name: dict(stats) for name, stats in self._stats.items()},
+            'total_parameter_bytes': sum(stats['parameter_bytes'] for stats in self._stats.values()),
+            'process_rss_bytes': _current_rss()
+        }
+
+    def prepare_for_fork(self):
+        """
+        Call in the parent after loading models and before forking workers.
+        Weights are moved to shared memory so children map the same pages, and
+        the collector stops touching the loaded objects so their pages stay
+        shared copy-on-write.
+        """
+        for entry in self._entries.values():
+            for module in _modules(entry):
+                module.share_memory()
+        gc.collect()
+        gc.freeze()
+
+    def unload(self, name=None):
+        """
+        Drop one model (or all) so the next get() reloads it
+        """
+        with self._lock:
+            names = [name] if name is not None else list(self._entries)
+            for key in names:
+                self._entries.pop(key, None)
+                self._stats.pop(key, None)
+
+
+_default_registry = ModelRegistry()
+
+
+def get_registry():
+    """
+    The registry shared by everything in this process
+    """
+    return _default_registry
\ No newline at end of file
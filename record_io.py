@@ -0,0 +1,71 @@
+# record_io.py
+"""
+Reading and writing the record files the offline tools share: JSONL/CSV
+image-question records in, JSONL results out, and JSON checkpoints and
+indexes that are replaced atomically so an interrupted run never leaves a
+half-written one.
+"""
+import csv
+import json
+import os
+
+
+def read_records(path):
+    """
+    Stream records from a JSONL or CSV file
+    """
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def ground_truth(record):
+    """
+    A record's reference answers as a list ('answers', or a single
+    'answer'), or None when it has none
+    """
+    if record.get('answers'):
+        answers = record['answers']
+        return [a['answer'] if isinstance(a, dict) else a for a in answers]
+    if record.get('answer'):
+        return [record['answer']]
+    return None
+
+
+def write_json_atomic(path, value):
+    """
+    Write value as JSON to a temporary file and rename it over path
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+class JsonlWriter:
+    """
+    Appends JSON rows to a file. commit() makes the rows written so far
+    durable and returns the byte offset to checkpoint; a resumed writer
+    opened with that offset drops whatever a killed run wrote after it.
+    """
+    def __init__(self, path, append, offset=None):
+        self._file = open(path, 'ab' if append else 'wb')
+        if append and offset is not None:
+            self._file.truncate(offset)
+
+    def write(self, rows):
+        for row in rows:
+            self._file.write((json.dumps(row) + '\n').encode('utf-8'))
+
+    def commit(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
\ No newline at end of file
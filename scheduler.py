@@ -0,0 +1,204 @@
+# scheduler.py
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the scheduler queue is full and the request is rejected"""
+
+
+class _Request:
+    __slots__ = ('args', 'future', 'enqueued_at', 'deadline')
+
+    def __init__(self, args, timeout):
+        self.args = args
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.deadline = self.enqueued_at + timeout if timeout else None
+
+
+class SchedulerMetrics:
+    """
+    Queue depth, batch-size histogram and request latency percentiles
+    """
+    def __init__(self, latency_window=2048):
+        self._lock = threading.Lock()
+        self.batch_sizes = {}
+        self.latencies = deque(maxlen=latency_window)
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.failed = 0
+        self.queue_depth = 0
+
+    def record_batch(self, size):
+        with self._lock:
+            self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.completed += 1
+
+    def increment(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def percentile(self, q):
+        with self._lock:
+            values = sorted(self.latencies)
+        if not values:
+            return 0.0
+        index = min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))
+        return values[index]
+
+    def snapshot(self):
+        """
+        Return a plain dict of the current metrics (latencies in milliseconds)
+        """
+        with self._lock:
+            counters = {
+                'queue_depth': self.queue_depth,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'failed': self.failed,
+                'batch_size_histogram': dict(sorted(self.batch_sizes.items()))
+            }
+        counters['latency_ms'] = {
+            'p50': round(self.percentile(50) * 1000, 2),
+            'p95': round(self.percentile(95) * 1000, 2),
+            'p99': round(self.percentile(99) * 1000, 2)
+        }
+        return counters
+
+
+class MicroBatchScheduler:
+    """
+    Queue incoming requests and dispatch them to a batch function in
+    micro-batches. A batch is sent when it reaches max_batch_size or when the
+    oldest request has waited max_wait_ms, whichever comes first.
+
+    batch_fn receives a list of request argument tuples and must return a
+    list of results in the same order. Each submit() returns a Future.
+    """
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=10,
+                 max_queue_size=64, rejection_policy='reject', request_timeout=30.0):
+        if rejection_policy not in ('reject', 'block'):
+            raise ValueError(f"Unknown rejection policy: {rejection_policy}")
+
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+        self.rejection_policy = rejection_policy
+        self.request_timeout = request_timeout
+        self.metrics = SchedulerMetrics()
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._running = True
+        self._worker = threading.Thread(target=self._run, name='vqa-micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, *args, timeout=None):
+        """
+        Queue one request and return a Future for its result. When the queue
+        is full the request is rejected with QueueFullError, or with the
+        'block' policy the caller waits until there is room (up to timeout).
+        """
+        timeout = self.request_timeout if timeout is None else timeout
+        request = _Request(args, timeout)
+
+        with self._condition:
+            if not self._running:
+                raise RuntimeError("Scheduler has been shut down")
+
+            while len(self._queue) >= self.max_queue_size:
+                if self.rejection_policy == 'reject':
+                    self.metrics.increment('rejected')
+                    raise QueueFullError(f"Request queue is full ({self.max_queue_size} pending)")
+                remaining = request.deadline - time.monotonic() if request.deadline else None
+                if remaining is not None and remaining <= 0:
+                    self.metrics.increment('rejected')
+                    raise QueueFullError("Timed out waiting for room in the request queue")
+                self._condition.wait(remaining)
+
+            self._queue.append(request)
+            self.metrics.increment('submitted')
+            self.metrics.queue_depth = len(self._queue)
+            self._condition.notify_all()
+
+        return request.future
+
+    def _next_batch(self):
+        with self._condition:
+            while self._running and not self._queue:
+                self._condition.wait()
+            if not self._queue:
+                return []
+
+            # Wait until the batch fills up or the oldest request's deadline passes
+            flush_at = self._queue[0].enqueued_at + self.max_wait
+            while self._running and len(self._queue) < self.max_batch_size:
+                remaining = flush_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch = []
+            while self._queue and len(batch) < self.max_batch_size:
+                batch.append(self._queue.popleft())
+            self.metrics.queue_depth = len(self._queue)
+            self._condition.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if not self._running:
+                    return
+                continue
+
+            # Drop requests that expired or were cancelled while queued
+            now = time.monotonic()
+            live = []
+            for request in batch:
+                if not request.future.set_running_or_notify_cancel():
+                    continue
+                if request.deadline is not None and now > request.deadline:
+                    self.metrics.increment('timed_out')
+                    request.future.set_exception(TimeoutError("Request timed out in the scheduler queue"))
+                else:
+                    live.append(request)
+            if not live:
+                continue
+
+            self.metrics.record_batch(len(live))
+            try:
+                results = self.batch_fn([request.args for request in live])
+            except Exception as e:
+                for request in live:
+                    self.metrics.increment('failed')
+                    request.future.set_exception(e)
+                continue
+
+            finished = time.monotonic()
+            for request, result in zip(live, results):
+                self.metrics.record_latency(finished - request.enqueued_at)
+                request.future.set_result(result)
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting requests; queued requests are still dispatched
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if wait:
+            self._worker.join()
\ No newline at end of file
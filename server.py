@@ -0,0 +1,306 @@
+# server.py
+"""
+Headless HTTP inference service for the VQA system.
+
+    uvicorn server:app --host 0.0.0.0 --port 8000
+
+Endpoints:
+    POST /vqa        one image and one question
+    POST /vqa/batch  one image and several questions
+    GET  /healthz    liveness / model readiness
+    GET  /metrics    Prometheus metrics (stage latencies, caches, scheduler, memory)
+    GET  /metrics/json  scheduler, cache and memory metrics as JSON
+
+Set VQA_WORKER_PROCESSES to serve from that many forked model workers
+(worker_pool.WorkerPool) instead of one in-process VQASystem; requests a
+worker doesn't answer within VQA_WORKER_TIMEOUT seconds fail with 504.
+VQA_CONCURRENT_STAGES=1 runs the image analysis alongside inference, and
+requests that exceed VQA_INFERENCE_TIMEOUT fail with 504. Uploads that
+aren't a decodable image fail with 400.
+
+Images are sent either as multipart/form-data (fields: image, question or
+questions) or as the raw request body with the question(s) in the query
+string, e.g. POST /vqa?question=What+color+is+the+car%3F
+"""
+import argparse
+import asyncio
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.datastructures import FormData
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.multipart import parse_options_header
+
+from vqa_system import StageTimeoutError, VQASystem
+from image_io import MAX_IMAGE_BYTES, ImageDecodeError, ImageTooLargeError
+from scheduler import QueueFullError
+from telemetry import configure_logging, get_telemetry
+from worker_pool import WorkerCrashedError, WorkerPool, WorkerTimeoutError
+
+MAX_UPLOAD_BYTES = MAX_IMAGE_BYTES  # VQA_MAX_UPLOAD_BYTES
+MAX_FIELD_BYTES = 1 << 16
+INFERENCE_WORKERS = int(os.environ.get('VQA_INFERENCE_WORKERS', 0))
+WORKER_PROCESSES = int(os.environ.get('VQA_WORKER_PROCESSES', 0))
+
+app = FastAPI(title="Visual Question Answering Service")
+
+# Concurrent requests are micro-batched by the scheduler inside VQASystem;
+# the thread pool keeps the blocking pipeline off the event loop
+vqa_system = None
+worker_pool = None
+executor = None
+
+
+@app.on_event('startup')
+def startup():
+    global vqa_system, worker_pool, executor
+    configure_logging()
+    if WORKER_PROCESSES:
+        # Forked before any inference runs in this process
+        worker_pool = WorkerPool(WORKER_PROCESSES).start()
+        get_telemetry().register_collector(worker_pool.metric_gauges)
+    else:
+        vqa_system = VQASystem(warmup='background', use_scheduler=True)
+        # Each request holds a thread while it waits on the scheduler; by
+        # default there are enough for one batch to fill while the previous
+        # one runs (VQA_INFERENCE_WORKERS overrides)
+        workers = INFERENCE_WORKERS or 2 * vqa_system.scheduler.max_batch_size
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='vqa-inference')
+        get_telemetry().register_collector(vqa_system.metric_gauges)
+    if os.environ.get('VQA_OTEL') == '1':
+        get_telemetry().enable_opentelemetry()
+
+
+@app.on_event('shutdown')
+def shutdown():
+    if executor is not None:
+        executor.shutdown(wait=False)
+    if worker_pool is not None:
+        worker_pool.shutdown()
+    if vqa_system is not None:
+        vqa_system.close()
+
+
+async def read_upload(request):
+    """
+    Return (image_bytes, form) from a multipart form or a raw request body.
+    Both are parsed straight off the request stream: the image goes into a
+    single buffer and is rejected with 413 as soon as it passes
+    MAX_UPLOAD_BYTES (or up front, from Content-Length).
+    """
+    content_type = request.headers.get('content-type', '')
+    is_multipart = content_type.startswith('multipart/form-data')
+    # A multipart body also carries the part headers and question fields
+    max_body = MAX_UPLOAD_BYTES + (MAX_FIELD_BYTES if is_multipart else 0)
+    if int(request.headers.get('content-length') or 0) > max_body:
+        raise HTTPException(status_code=413, detail="Image is too large")
+
+    if is_multipart:
+        data, form = await _read_multipart(request, content_type)
+    else:
+        form = None
+        buffer = io.BytesIO()
+        async for chunk in request.stream():
+            if buffer.tell() + len(chunk) > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail="Image is too large")
+            buffer.write(chunk)
+        # getvalue() hands over the buffer without copying it
+        data = buffer.getvalue()
+
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty image upload")
+    return data, form
+
+
+class _MultipartReader:
+    """
+    Incremental multipart/form-data parsing (python-multipart, as Starlette
+    uses) that writes the 'image' file part into one buffer and keeps the
+    other parts as text fields, instead of spooling the body to a
+    temporary file and copying it out again
+    """
+    def __init__(self, boundary):
+        self.image = None
+        self.fields = []
+        self._headers = {}
+        self._header_field = b''
+        self._header_value = b''
+        self._name = None
+        self._is_image = False
+        self._buffer = None
+        self.parser = multipart.MultipartParser(boundary, {
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b''
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        self._name = options.get(b'name', b'').decode('utf-8', errors='replace')
+        self._is_image = self._name == 'image' and b'filename' in options
+        self._buffer = io.BytesIO()
+
+    def _on_part_data(self, data, start, end):
+        limit = MAX_UPLOAD_BYTES if self._is_image else MAX_FIELD_BYTES
+        if self._buffer.tell() + end - start > limit:
+            detail = "Image is too large" if self._is_image else f"Form field {self._name!r} is too large"
+            raise HTTPException(status_code=413, detail=detail)
+        self._buffer.write(data[start:end])
+
+    def _on_part_end(self):
+        if self._is_image:
+            self.image = self._buffer.getvalue()
+        else:
+            self.fields.append((self._name, self._buffer.getvalue().decode('utf-8', errors='replace')))
+        self._buffer = None
+
+
+async def _read_multipart(request, content_type):
+    _, options = parse_options_header(content_type)
+    boundary = options.get(b'boundary')
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Missing multipart boundary")
+    reader = _MultipartReader(boundary)
+    try:
+        async for chunk in request.stream():
+            reader.parser.write(chunk)
+        reader.parser.finalize()
+    except multipart.exceptions.MultipartParseError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+    if reader.image is None:
+        raise HTTPException(status_code=400, detail="Missing 'image' file field")
+    return reader.image, FormData(reader.fields)
+
+
+def _questions(request, form, many):
+    fields = form if form is not None else request.query_params
+    if many:
+        questions = fields.getlist('questions') or fields.getlist('question')
+    else:
+        questions = [fields.get('question')]
+    questions = [q.strip() for q in questions if q and q.strip()]
+    if not questions:
+        raise HTTPException(status_code=400, detail="No question provided")
+    return questions
+
+
+def _run_pipeline(image_bytes, questions, many):
+    # The pipeline decodes the uploaded bytes once, in memory
+    if many:
+        return vqa_system.process_batch(image_bytes, questions)
+    return vqa_system.process_input(image_bytes, questions[0])
+
+
+async def _infer(image_bytes, questions, many=False):
+    if worker_pool is not None:
+        try:
+            return await asyncio.wrap_future(worker_pool.submit(image_bytes, questions, many=many))
+        except WorkerCrashedError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except (WorkerTimeoutError, StageTimeoutError) as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except ImageDecodeError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, _run_pipeline, image_bytes, questions, many)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except StageTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _jsonable(results):
+    # image_analysis['shape'] is a tuple; everything else is already JSON-safe
+    if isinstance(results, list):
+        return [_jsonable(r) for r in results]
+    results = dict(results)
+    shape = results['image_analysis']['shape']
+    if isinstance(shape, tuple):
+        results['image_analysis'] = dict(results['image_analysis'], shape=list(shape))
+    return results
+
+
+@app.post('/vqa')
+async def vqa(request: Request):
+    image_bytes, form = await read_upload(request)
+    questions = _questions(request, form, many=False)
+    results = await _infer(image_bytes, questions)
+    return JSONResponse(_jsonable(results))
+
+
+@app.post('/vqa/batch')
+async def vqa_batch(request: Request):
+    image_bytes, form = await read_upload(request)
+    questions = _questions(request, form, many=True)
+    results = await _infer(image_bytes, questions, many=True)
+    return JSONResponse({'results': _jsonable(results)})
+
+
+@app.get('/healthz')
+def healthz():
+    if worker_pool is not None:
+        return {'status': 'ok', 'model_ready': worker_pool.ready(), 'workers': worker_pool.stats()}
+    ready = vqa_system is not None and vqa_system.vqa_model.use_real_model is not None
+    return {'status': 'ok', 'model_ready': ready}
+
+
+@app.get('/metrics')
+def metrics():
+    return PlainTextResponse(get_telemetry().prometheus_text(), media_type='text/plain; version=0.0.4')
+
+
+@app.get('/metrics/json')
+def metrics_json():
+    if worker_pool is not None:
+        return {'workers': worker_pool.stats()}
+    if vqa_system is None:
+        return {}
+    return {
+        'scheduler': vqa_system.scheduler.metrics.snapshot() if vqa_system.scheduler is not None else None,
+        'answer_cache': vqa_system.answer_cache.stats() if vqa_system.answer_cache is not None else None,
+        'feature_cache': vqa_system.feature_cache.stats(),
+        'memory': vqa_system.memory_report(),
+        'startup': vqa_system.startup_timings()
+    }
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the VQA inference server")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
\ No newline at end of file
@@ -0,0 +1,266 @@
+# telemetry.py
+"""
+Lightweight tracing and metrics for the VQA pipeline.
+
+    from telemetry import get_telemetry
+    telemetry = get_telemetry()
+
+    with telemetry.span('decode'):
+        ...
+    telemetry.increment('vqa_answer_cache_requests_total', result='hit')
+    telemetry.observe('vqa_answer_confidence', 87.5)
+
+Spans record their duration in the vqa_stage_seconds histogram (labelled by
+stage) and, once enable_opentelemetry() has been called, are also exported
+as OpenTelemetry spans. Everything renders as Prometheus text exposition.
+
+Set VQA_TELEMETRY=0 to turn collection off: span() then returns a shared
+no-op context manager and the recording methods return immediately.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONFIDENCE_BUCKETS = (10, 20, 30, 40, 50, 60, 70, 80, 90, 100)
+
+METRIC_HELP = {
+    'vqa_stage_seconds': ('histogram', "Time spent in each pipeline stage"),
+    'vqa_request_seconds': ('histogram', "End-to-end time to answer one question"),
+    'vqa_answer_confidence': ('histogram', "Model confidence of returned answers (percent)"),
+    'vqa_answer_cache_requests_total': ('counter', "Answer cache lookups by result"),
+    'vqa_model_fallbacks_total': ('counter', "Times the rule-based model was used instead of ViLT"),
+    'vqa_routing_decisions_total': ('counter', "Answers by route (cheap, answer, escalate, fallback) and question type"),
+    'vqa_errors_total': ('counter', "Errors by pipeline stage"),
+    'vqa_stage_timeouts_total': ('counter', "Pipeline stages abandoned after their timeout"),
+}
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    def __init__(self, telemetry, name, attributes):
+        self.telemetry = telemetry
+        self.name = name
+        self.attributes = attributes
+        self._otel_context = None
+
+    def __enter__(self):
+        tracer = self.telemetry._tracer
+        if tracer is not None:
+            self._otel_context = tracer.start_as_current_span(self.name, attributes=self.attributes)
+            self._otel_context.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self._start
+        self.telemetry.observe('vqa_stage_seconds', seconds, stage=self.name)
+        if exc_type is not None:
+            self.telemetry.increment('vqa_errors_total', stage=self.name)
+        if self._otel_context is not None:
+            self._otel_context.__exit__(exc_type, exc, traceback)
+        return False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{value}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+class Telemetry:
+    """
+    Thread-safe counters and histograms keyed by metric name and labels
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._buckets = {'vqa_answer_confidence': CONFIDENCE_BUCKETS}
+        self._collectors = []
+        self._tracer = None
+
+    def span(self, name, **attributes):
+        """
+        Context manager timing one pipeline stage
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name, attributes)
+
+    def increment(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self._buckets.get(name, LATENCY_BUCKETS))
+            histogram.observe(value)
+
+    def register_collector(self, collector):
+        """
+        Add a callable returning (name, labels_dict, value) triples, sampled as
+        gauges on every export (e.g. queue depth)
+        """
+        self._collectors.append(collector)
+
+    def enable_opentelemetry(self, tracer_provider=None):
+        """
+        Also export spans through OpenTelemetry (needs opentelemetry-api and
+        a configured SDK/exporter)
+        """
+        from opentelemetry import trace
+
+        self._tracer = trace.get_tracer('vqa', tracer_provider=tracer_provider)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def prometheus_text(self):
+        """
+        Render every metric in the Prometheus text exposition format
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: (h.buckets, list(h.counts), h.total, h.count) for key, h in self._histograms.items()
+            }
+
+        lines = []
+        described = set()
+
+        def describe(name, default_type):
+            if name in described:
+                return
+            described.add(name)
+            metric_type, help_text = METRIC_HELP.get(name, (default_type, None))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in sorted(counters.items()):
+            describe(name, 'counter')
+            lines.append(f"{name}{_label_text(labels)} {value}")
+
+        for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            describe(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{_label_text(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_label_text(labels)} {total}")
+            lines.append(f"{name}_count{_label_text(labels)} {count}")
+
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logging.getLogger(__name__).warning("Metrics collector failed: %s", e)
+                continue
+            for name, labels, value in samples:
+                if value is None:
+                    continue
+                describe(name, 'gauge')
+                lines.append(f"{name}{_label_text(tuple(sorted(labels.items())))} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+
+class JsonLogFormatter(logging.Formatter):
+    """
+    One JSON object per record, including any fields passed via extra=
+    """
+    _reserved = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in self._reserved:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None, json_format=None):
+    """
+    Configure root logging for the pipeline; VQA_LOG_LEVEL and VQA_LOG_JSON
+    set the defaults
+    """
+    level = level or os.environ.get('VQA_LOG_LEVEL', 'INFO')
+    if json_format is None:
+        json_format = os.environ.get('VQA_LOG_JSON', '0') == '1'
+    handler = logging.StreamHandler()
+    if json_format:
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry():
+    """
+    The process-wide Telemetry instance
+    """
+    global _telemetry
+    if _telemetry is None:
+        with _telemetry_lock:
+            if _telemetry is None:
+                _telemetry = Telemetry(enabled=os.environ.get('VQA_TELEMETRY', '1') != '0')
+    return _telemetry
\ No newline at end of file
@@ -1,7 +1,21 @@
 # test_vqa.py
+import os
+import tempfile
+import threading
 import unittest
+import numpy as np
 from vqa_system import VQASystem
 from utils.text_processor import TextProcessor
+from scheduler import MicroBatchScheduler, QueueFullError
+from answer_cache import AnswerCache, MemoryAnswerBackend
+from feature_cache import FeatureCache
+from telemetry import Telemetry
+from fast_path import FastPathAnswerer
+from dominant_colors import DominantColorEngine, color_error
+from image_io import ingest_image, image_content_hash, ImageDecodeError, ImageTooLargeError
+from corpus_index import CorpusIndex
+from evaluate_vqa import normalize_answer, vqa_accuracy
+from models.vqa_model import RealVQAModel, HybridVQAModel, RoutingPolicy, DEFAULT_ONNX_PATH
 
 class TestVQASystem(unittest.TestCase):
     
@@ -14,12 +28,21 @@ class TestVQASystem(unittest.TestCase):
             ("how many people are there?", "counting"),
             ("what color is the car?", "color"), 
             ("is there a dog in the image?", "existence"),
-            ("where is the book?", "location")
+            ("where is the book?", "location"),
+            ("where is the dog?", "location"),
+            ("what does the sign say?", "description"),
+            ("does the man have a hat?", "existence"),
+            ("what colour are the flowers?", "color"),
+            ("is the door open?", "general")
         ]
         
         for question, expected_type in test_cases:
             detected_type = self.text_processor.identify_question_type(question)
             self.assertEqual(detected_type, expected_type)
+        
+        questions = [question for question, _ in test_cases]
+        self.assertEqual(self.text_processor.identify_question_types(questions),
+                         [expected_type for _, expected_type in test_cases])
     
     def test_keyword_extraction(self):
         question = "How many red cars are in this picture?"
@@ -28,6 +51,366 @@ class TestVQASystem(unittest.TestCase):
         self.assertIn('red', keywords)
         self.assertIn('cars', keywords)
         self.assertNotIn('how', keywords)
+        
+        # Contractions split the way NLTK's word_tokenize splits them
+        self.assertEqual(self.text_processor.extract_keywords("Why isn't the dog's bowl full?"),
+                         ["n't", 'dog', 'bowl', 'full'])
+        self.assertEqual(self.text_processor.extract_keywords_batch([question, question]),
+                         [keywords, keywords])
+
+class TestConcurrentStages(unittest.TestCase):
+    
+    class SlowAnalysis:
+        def __init__(self):
+            self.release = threading.Event()
+        
+        def simple_image_analysis(self, image, cancel=None):
+            # Runs until released, or until a timeout cancels it
+            while not self.release.wait(0.01):
+                if cancel is not None and cancel.is_set():
+                    return {}
+            return {'shape': image.shape, 'brightness': 100.0}
+    
+    class FixedModel:
+        def predict_batch(self, pairs):
+            return [{'answer': 'red', 'confidence': 90.0, 'top_k': [], 'model': 'ViLT'} for _ in pairs]
+    
+    def concurrent_system(self, **kwargs):
+        system = VQASystem(concurrent_stages=True, use_answer_cache=False, fast_path=False, **kwargs)
+        system.image_processor = self.SlowAnalysis()
+        system.vqa_model.use_real_model = True
+        system.vqa_model.real_model = self.FixedModel()
+        self.addCleanup(system.close)
+        return system
+    
+    def test_analysis_timeout_answers_without_it(self):
+        system = self.concurrent_system(stage_timeouts={'image_analysis': 0.05})
+        results = system.process_input(np.zeros((8, 8, 3), dtype=np.uint8), "what color is the car?")
+        
+        self.assertEqual(results['answer'], 'red')
+        self.assertTrue(results['image_analysis']['timed_out'])
+    
+    def test_answer_first_returns_before_the_analysis(self):
+        system = self.concurrent_system()
+        results, analysis = system.process_input_answer_first(np.zeros((8, 8, 3), dtype=np.uint8),
+                                                              "what color is the car?")
+        
+        self.assertEqual(results['answer'], 'red')
+        self.assertIsNone(results['image_analysis'])
+        self.assertFalse(analysis.done())
+        system.image_processor.release.set()
+        self.assertEqual(analysis.result(timeout=5), {'shape': (8, 8, 3), 'brightness': 100.0})
+
+class TestMicroBatchScheduler(unittest.TestCase):
+    
+    def test_batches_requests_in_order(self):
+        batches = []
+        
+        def double(requests):
+            batches.append(len(requests))
+            return [value * 2 for (value,) in requests]
+        
+        scheduler = MicroBatchScheduler(double, max_batch_size=4, max_wait_ms=50)
+        futures = [scheduler.submit(i) for i in range(4)]
+        
+        self.assertEqual([f.result(timeout=5) for f in futures], [0, 2, 4, 6])
+        self.assertEqual(batches, [4])
+        self.assertEqual(scheduler.metrics.snapshot()['batch_size_histogram'], {4: 1})
+        scheduler.shutdown()
+    
+    def test_rejects_when_queue_is_full(self):
+        scheduler = MicroBatchScheduler(lambda requests: requests, max_batch_size=8,
+                                        max_wait_ms=1000, max_queue_size=2)
+        scheduler.submit(1)
+        scheduler.submit(2)
+        
+        with self.assertRaises(QueueFullError):
+            scheduler.submit(3)
+        scheduler.shutdown()
+
+class TestAnswerCache(unittest.TestCase):
+    
+    def test_evicts_least_recently_used(self):
+        cache = AnswerCache(MemoryAnswerBackend(max_entries=2), ttl=60)
+        cache.set('img', 'how many dogs?', {'answer': '2', 'confidence': 91.5})
+        cache.set('img', 'what color is the car?', {'answer': 'red', 'confidence': 80.0})
+        cache.get('img', 'how many dogs?')
+        cache.set('img', 'is it raining?', {'answer': 'no', 'confidence': 75.0})
+        
+        self.assertEqual(cache.get('img', 'how many dogs?')['answer'], '2')
+        self.assertIsNone(cache.get('img', 'what color is the car?'))
+    
+    def test_expired_entries_are_misses(self):
+        cache = AnswerCache(MemoryAnswerBackend(), ttl=-1)
+        cache.set('img', 'how many dogs?', {'answer': '2', 'confidence': 91.5})
+        
+        self.assertIsNone(cache.get('img', 'how many dogs?'))
+        self.assertEqual(cache.stats(), {'hits': 0, 'misses': 1})
+    
+    def test_keys_include_the_model_fingerprint(self):
+        cache = AnswerCache(MemoryAnswerBackend(), ttl=60)
+        cache.set('img', 'how many dogs?', {'answer': '2', 'confidence': 91.5}, 'int8')
+        
+        self.assertEqual(cache.get('img', 'how many dogs?', 'int8')['answer'], '2')
+        self.assertIsNone(cache.get('img', 'how many dogs?', 'fp32'))
+
+class TestFeatureCache(unittest.TestCase):
+    
+    def test_evicts_least_recently_used_within_the_byte_budget(self):
+        cache = FeatureCache(max_bytes=200)
+        cache.put('resnet', 'a', np.zeros(10))
+        cache.put('resnet', 'b', np.zeros(10))
+        cache.get('resnet', 'a')
+        cache.put('resnet', 'c', np.zeros(10))
+        
+        self.assertIsNotNone(cache.get('resnet', 'a'))
+        self.assertIsNone(cache.get('resnet', 'b'))
+        self.assertEqual(cache.stats()['bytes'], 160)
+        self.assertEqual(cache.stats()['evictions'], 1)
+    
+    def test_config_change_invalidates_the_namespace(self):
+        with tempfile.TemporaryDirectory() as disk_dir:
+            cache = FeatureCache(disk_dir=disk_dir)
+            cache.configure('resnet', {'size': 224})
+            cache.configure('vilt', {'size': 384})
+            cache.put('resnet', 'a', np.zeros(10))
+            cache.put('vilt', 'a', np.ones(10))
+            
+            cache.configure('resnet', {'size': 224})
+            self.assertIsNotNone(cache.get('resnet', 'a'))
+            cache.configure('resnet', {'size': 256})
+            self.assertIsNone(cache.get('resnet', 'a'))
+            self.assertIsNotNone(cache.get('vilt', 'a'))
+            # The old config's disk entries are gone too
+            cache.configure('resnet', {'size': 224})
+            self.assertIsNone(cache.get('resnet', 'a'))
+    
+    def test_disk_tier_survives_a_restart(self):
+        with tempfile.TemporaryDirectory() as disk_dir:
+            FeatureCache(disk_dir=disk_dir).put('resnet', 'a', np.arange(10.0))
+            
+            cache = FeatureCache(disk_dir=disk_dir)
+            np.testing.assert_array_equal(cache.get('resnet', 'a'), np.arange(10.0))
+            self.assertEqual(cache.stats()['disk_hits'], 1)
+            cache.get('resnet', 'a')
+            self.assertEqual(cache.stats()['hits'], 1)
+
+class TestTelemetry(unittest.TestCase):
+    
+    def test_spans_export_as_prometheus_histograms(self):
+        telemetry = Telemetry()
+        with telemetry.span('decode'):
+            pass
+        telemetry.increment('vqa_answer_cache_requests_total', result='hit')
+        
+        text = telemetry.prometheus_text()
+        self.assertIn('vqa_stage_seconds_count{stage="decode"} 1', text)
+        self.assertIn('vqa_answer_cache_requests_total{result="hit"} 1', text)
+    
+    def test_disabled_telemetry_records_nothing(self):
+        telemetry = Telemetry(enabled=False)
+        with telemetry.span('decode'):
+            pass
+        telemetry.increment('vqa_errors_total', stage='decode')
+        
+        self.assertEqual(telemetry.prometheus_text(), '\n')
+
+class TestRouting(unittest.TestCase):
+    
+    class FixedModel:
+        def __init__(self, confidence, answer):
+            self.confidence = confidence
+            self.answer = answer
+        
+        def predict_batch(self, pairs):
+            return [{'answer': self.answer, 'confidence': self.confidence,
+                     'top_k': [{'answer': self.answer, 'confidence': self.confidence}], 'model': 'ViLT'}
+                    for _ in pairs]
+    
+    def routed_model(self, confidence, cheap_model=None):
+        model = HybridVQAModel(routing=RoutingPolicy(threshold=50, thresholds={'counting': 80}, cheap_threshold=90),
+                               cheap_model=cheap_model)
+        model.use_real_model = True
+        model.real_model = self.FixedModel(confidence, 'light')
+        model.escalation_model = self.FixedModel(70.0, 'heavy')
+        return model
+    
+    def test_low_confidence_answers_are_escalated(self):
+        model = self.routed_model(60.0)
+        results = model.predict_batch([({}, "what is it?", 'description', 'img'),
+                                       ({}, "how many?", 'counting', 'img')])
+        
+        self.assertEqual([(r['answer'], r['route']) for r in results],
+                         [('light', 'answer'), ('heavy', 'escalate')])
+    
+    def test_confident_cheap_answers_skip_the_model(self):
+        cheap = lambda analysis, question, question_type, image: (
+            {'answer': 'red', 'confidence': 95.0, 'model': 'cheap'} if question_type == 'color' else None)
+        model = self.routed_model(99.0, cheap_model=cheap)
+        results = model.predict_batch([({}, "what color?", 'color', 'img'),
+                                       ({}, "what is it?", 'description', 'img')])
+        
+        self.assertEqual([(r['answer'], r['route']) for r in results],
+                         [('red', 'cheap'), ('light', 'answer')])
+    
+    def test_fast_path_guards_are_the_only_gate(self):
+        # An 80% share passes min_color_share=0.75 but is below cheap_threshold=90
+        analysis = {'colors_detected': np.array([[200, 30, 30]]), 'color_proportions': np.array([0.8])}
+        model = self.routed_model(99.0, cheap_model=FastPathAnswerer(min_color_share=0.75))
+        results = model.predict_batch([(analysis, "what color?", 'color', 'img')])
+        
+        self.assertEqual([(r['answer'], r['route']) for r in results], [('red', 'cheap')])
+
+class TestFastPath(unittest.TestCase):
+    
+    def setUp(self):
+        self.answerer = FastPathAnswerer(min_color_share=0.75, dark_max=50, bright_min=190)
+    
+    def test_answers_dominant_color_only_when_it_covers_the_image(self):
+        uniform = {'colors_detected': np.array([[200, 30, 30], [0, 0, 0]]), 'color_proportions': np.array([0.9, 0.1])}
+        mixed = {'colors_detected': np.array([[200, 30, 30], [0, 0, 0]]), 'color_proportions': np.array([0.5, 0.5])}
+        
+        self.assertEqual(self.answerer(uniform, "what color is the wall?", 'color')['answer'], 'red')
+        self.assertIsNone(self.answerer(mixed, "what color is the wall?", 'color'))
+    
+    def test_brightness_questions(self):
+        self.assertEqual(self.answerer({'brightness': 20.0}, "Is it dark?", 'general')['answer'], 'yes')
+        self.assertEqual(self.answerer({'brightness': 230.0}, "is it night?", 'general')['answer'], 'no')
+        self.assertIsNone(self.answerer({'brightness': 120.0}, "is the room bright?", 'general'))
+        self.assertIsNone(self.answerer({'brightness': 20.0}, "is the light on?", 'general'))
+
+class TestDominantColors(unittest.TestCase):
+    
+    COLORS = [(200, 40, 40), (40, 160, 60), (30, 60, 190)]
+    
+    def setUp(self):
+        # Half red, a quarter green, a quarter blue
+        self.image = np.zeros((120, 160, 3), dtype=np.uint8)
+        self.image[:, :80] = self.COLORS[0]
+        self.image[:, 80:120] = self.COLORS[1]
+        self.image[:, 120:] = self.COLORS[2]
+    
+    def assert_finds_known_colors(self, method):
+        centers, proportions = DominantColorEngine(method=method, seed=3).analyze(self.image, k=3)
+        
+        self.assertLess(color_error(centers, self.COLORS), 2.0)
+        self.assertEqual([tuple(c) for c in centers[:1]], [self.COLORS[0]])
+        np.testing.assert_allclose(proportions, [0.5, 0.25, 0.25], atol=0.02)
+    
+    def test_exact(self):
+        self.assert_finds_known_colors('exact')
+    
+    def test_kmeans(self):
+        self.assert_finds_known_colors('kmeans')
+    
+    def test_minibatch(self):
+        self.assert_finds_known_colors('minibatch')
+    
+    def test_histogram(self):
+        self.assert_finds_known_colors('histogram')
+    
+    def test_same_seed_gives_the_same_colors(self):
+        noise = np.random.RandomState(1).randint(-20, 21, size=self.image.shape)
+        noisy = np.clip(self.image.astype(int) + noise, 0, 255).astype(np.uint8)
+        for method in ('exact', 'kmeans', 'minibatch', 'histogram'):
+            engine = DominantColorEngine(method=method, seed=7)
+            centers, proportions = engine.analyze(noisy)
+            for repeat in (engine, DominantColorEngine(method=method, seed=7)):
+                repeat_centers, repeat_proportions = repeat.analyze(noisy)
+                np.testing.assert_array_equal(repeat_centers, centers)
+                np.testing.assert_array_equal(repeat_proportions, proportions)
+
+class TestImageIngestion(unittest.TestCase):
+    
+    def setUp(self):
+        import cv2
+        self.jpeg = cv2.imencode('.jpg', np.full((1200, 1600, 3), 128, dtype=np.uint8))[1].tobytes()
+    
+    def test_decodes_to_bounded_resolution(self):
+        pixels, shape = ingest_image(self.jpeg, max_side=400)
+        
+        self.assertEqual(shape, (1200, 1600, 3))
+        self.assertEqual(max(pixels.shape[:2]), 400)
+    
+    def test_enforces_byte_and_pixel_limits(self):
+        with self.assertRaises(ImageTooLargeError):
+            ingest_image(self.jpeg, max_bytes=100)
+        with self.assertRaises(ImageTooLargeError):
+            ingest_image(self.jpeg, max_side=0, max_pixels=1000)
+    
+    def test_rejects_undecodable_data(self):
+        with self.assertRaises(ImageDecodeError):
+            ingest_image(b'notanimage')
+        with self.assertRaises(ImageDecodeError):
+            ingest_image(self.jpeg[:len(self.jpeg) // 2], max_side=0)
+    
+    def test_streams_hash_by_content(self):
+        import io
+        import cv2
+        other = cv2.imencode('.png', np.zeros((8, 8, 3), dtype=np.uint8))[1].tobytes()
+        
+        self.assertEqual(image_content_hash(io.BytesIO(self.jpeg)), image_content_hash(io.BytesIO(self.jpeg)))
+        self.assertEqual(image_content_hash(io.BytesIO(self.jpeg)), image_content_hash(self.jpeg))
+        self.assertNotEqual(image_content_hash(io.BytesIO(self.jpeg)), image_content_hash(io.BytesIO(other)))
+        with self.assertRaises(TypeError):
+            image_content_hash(object())
+
+class TestVQAAccuracy(unittest.TestCase):
+    
+    def test_single_reference_is_exact_match(self):
+        self.assertEqual(vqa_accuracy('red', ['red']), 1.0)
+        self.assertEqual(vqa_accuracy('blue', ['red']), 0.0)
+    
+    def test_ten_humans_average_the_leave_one_out_subsets(self):
+        # Leaving out one of the 3 matches leaves 2 (2/3); any other subset has 3 (1)
+        answers = ['2'] * 3 + ['3'] * 7
+        self.assertAlmostEqual(vqa_accuracy('2', answers), (3 * 2 / 3 + 7 * 1.0) / 10)
+        # 2 matches: 1/3 or 2/3
+        answers = ['2'] * 2 + ['3'] * 8
+        self.assertAlmostEqual(vqa_accuracy('2', answers), (2 * 1 / 3 + 8 * 2 / 3) / 10)
+        self.assertEqual(vqa_accuracy('3', answers), 1.0)
+    
+    def test_normalization(self):
+        self.assertEqual(normalize_answer('Two dogs.'), '2 dogs')
+        self.assertEqual(normalize_answer('The red car!'), 'red car')
+        self.assertEqual(normalize_answer('an apple'), 'apple')
+        self.assertEqual(vqa_accuracy('two', ['2']), 1.0)
+
+class TestCorpusIndex(unittest.TestCase):
+    
+    def test_round_trips_tensors_across_shards(self):
+        import tempfile
+        tensors = {f'img{i}.jpg': np.random.RandomState(i).randn(3, 32, 32 + 8 * i).astype(np.float32)
+                   for i in range(3)}
+        with tempfile.TemporaryDirectory() as path:
+            index = CorpusIndex.create(path, 'fingerprint', shard_bytes=10000)
+            for key, values in tensors.items():
+                index.write(key, values)
+            index.flush()
+            index.close()
+            
+            index = CorpusIndex(path)
+            self.assertEqual(index.keys(), list(tensors))
+            self.assertEqual(len(index.shards), 3)
+            for key, values in tensors.items():
+                np.testing.assert_allclose(index.get(key), values, atol=1e-2)
+
+@unittest.skipUnless(os.path.exists(os.path.join(DEFAULT_ONNX_PATH, 'model.onnx')),
+                     "no ONNX export; run python export_vilt.py exports/vilt")
+class TestOnnxBackend(unittest.TestCase):
+    
+    def test_answers_match_eager_model(self):
+        rng = np.random.RandomState(0)
+        images = [rng.randint(0, 256, size=(240, 320, 3), dtype=np.uint8) for _ in range(3)]
+        pairs = [(image, question) for image in images
+                 for question in ("What color is it?", "How many objects are there?")]
+        
+        eager = RealVQAModel(backend='torch').predict_batch(pairs)
+        onnx = RealVQAModel(backend='onnx').predict_batch(pairs)
+        
+        self.assertEqual([r['answer'] for r in onnx], [r['answer'] for r in eager])
+        for onnx_result, eager_result in zip(onnx, eager):
+            self.assertAlmostEqual(onnx_result['confidence'], eager_result['confidence'], delta=1.0)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
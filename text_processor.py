@@ -1,22 +1,147 @@
 # utils/text_processor.py
-from transformers import BertTokenizer, BertModel
-import torch
+from collections import OrderedDict
+import itertools
+import json
+import threading
+import time
+import numpy as np
 import re
-import nltk
-from nltk.tokenize import word_tokenize
 
-# Download required NLTK data
-try:
-    nltk.download('punkt')
-except:
-    print("NLTK punkt not available, using simple tokenization")
+from model_registry import get_registry
+
+# Question typing and keyword extraction are pure Python; torch and
+# transformers are only imported when BERT embeddings are first needed
+
+
+def _load_bert():
+    from transformers import BertTokenizer, BertModel
+    
+    tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
+    model = BertModel.from_pretrained('bert-base-uncased')
+    model.eval()
+    return tokenizer, model
+
+
+def read_questions(path):
+    """
+    Stream questions from a text file (one per line) or a JSONL file with a
+    'question' field, without loading the whole file
+    """
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith('.jsonl'):
+                yield json.loads(line)['question']
+            else:
+                yield line
+
+
+# Question types in priority order: a question gets the first type whose
+# phrases it contains (as whole words). Existence auxiliaries only count at
+# the start, so "what does ..." stays a description question.
+QUESTION_TYPE_RULES = (
+    ('counting', (r'how many', r'count', r'number of')),
+    ('color', (r'what colou?r', r'colou?rs?')),
+    ('location', (r'where', r'which location', r'position')),
+    ('description', (r'what is', r'describe', r'what does')),
+    ('existence', (r'is there', r'are there', r'^\s*(?:does|do|has)\b')),
+)
+
+
+class QuestionTypeClassifier:
+    """
+    Question-type rules compiled into one regex. Each type is a lookahead
+    branch, tried in priority order, so one match() call returns the
+    highest-priority type that occurs anywhere in the question.
+    """
+    def __init__(self, rules=QUESTION_TYPE_RULES, default='general'):
+        self.types = [name for name, _ in rules]
+        self.default = default
+        branches = [
+            '(?=.*?(?:' + '|'.join(self._phrase_pattern(phrase) for phrase in phrases) + f'))(?P<{name}>)'
+            for name, phrases in rules
+        ]
+        self._pattern = re.compile('(?:' + '|'.join(branches) + ')', re.IGNORECASE | re.DOTALL)
+
+    @staticmethod
+    def _phrase_pattern(phrase):
+        # Anchored phrases are used as written, the rest must be whole words
+        return phrase if phrase.startswith('^') else r'\b' + phrase + r'\b'
+
+    def classify(self, question):
+        match = self._pattern.match(question)
+        return match.lastgroup if match else self.default
+    
+    def classify_batch(self, questions):
+        """
+        Classify a whole question log; repeated questions are matched once
+        """
+        seen = {}
+        types = []
+        for question in questions:
+            question_type = seen.get(question)
+            if question_type is None:
+                question_type = seen[question] = self.classify(question)
+            types.append(question_type)
+        return types
+
+
+# Compiled once and shared by every TextProcessor
+DEFAULT_QUESTION_CLASSIFIER = QuestionTypeClassifier()
+
+KEYWORD_STOP_WORDS = frozenset({'the', 'a', 'an', 'is', 'are', 'what', 'where', 'how', 'why', 'when'})
+
+# Word tokenizer matching NLTK's word_tokenize (Treebank rules) on
+# questions, without NLTK or its punkt data
+TOKEN_PATTERN = re.compile(r"""
+    \b(?:can(?=not\b)|gon(?=na\b)|got(?=ta\b)|wan(?=na\b)|lem(?=me\b)|gim(?=me\b))  # cannot -> can not
+  | (?:[^\W\d_]\.){2,}                                                  # u.s., p.m.
+  | \w+(?=n't\b) | n't\b                                                # don't -> do n't
+  | '(?:s|m|d|ll|re|ve)\b                                               # it's -> it 's
+  | \w+(?:(?:[-./]|[,:](?=\d)|'(?!(?:s|m|d|ll|re|ve|t)\b))\w+)*          # e-mail, 4.5, 3:30, o'clock
+  | \.\.\.
+  | [^\w\s]
+""", re.VERBOSE | re.IGNORECASE)
+
 
 class TextProcessor:
-    def __init__(self):
-        # Load pre-trained BERT model and tokenizer
-        self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-        self.model = BertModel.from_pretrained('bert-base-uncased')
-        self.model.eval()
+    def __init__(self, embedding_cache_size=4096):
+        # BERT is loaded on first use; question typing and keyword
+        # extraction don't need it
+        self._tokenizer = None
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.load_seconds = None
+        
+        # Question embeddings keyed by normalized question
+        self.embedding_cache_size = embedding_cache_size
+        self._embedding_cache = OrderedDict()
+        self._embedding_cache_lock = threading.Lock()
+        
+        self.question_classifier = DEFAULT_QUESTION_CLASSIFIER
+    
+    def _load_bert(self):
+        with self._model_lock:
+            if self._model is None:
+                # Shared with every other TextProcessor in this process
+                start = time.perf_counter()
+                self._tokenizer, model = get_registry().get('bert-base-uncased', _load_bert)
+                self.load_seconds = time.perf_counter() - start
+                self._model = model
+    
+    @property
+    def tokenizer(self):
+        if self._model is None:
+            self._load_bert()
+        return self._tokenizer
+    
+    @property
+    def model(self):
+        if self._model is None:
+            self._load_bert()
+        return self._model
     
     def preprocess_question(self, question):
         """
@@ -34,53 +159,99 @@ class TextProcessor:
         """
         Extract embeddings from question using BERT
         """
-        # Preprocess question
-        cleaned_question = self.preprocess_question(question)
+        return self.embed_questions([question])[0]
+    
+    def embed_questions(self, questions, batch_size=32, max_length=128):
+        """
+        Embed many questions with batched BERT calls. Questions are sorted by
+        token length so each batch is padded only to its own longest question,
+        and mean pooling ignores padding. Repeated questions come from an LRU
+        cache keyed by the normalized question.
+        """
+        cleaned = [self.preprocess_question(q) for q in questions]
+        embeddings = {}
         
-        # Tokenize and encode
-        inputs = self.tokenizer(
-            cleaned_question, 
-            return_tensors='pt', 
-            padding=True, 
-            truncation=True, 
-            max_length=128
-        )
+        with self._embedding_cache_lock:
+            for question in cleaned:
+                if question in self._embedding_cache:
+                    self._embedding_cache.move_to_end(question)
+                    embeddings[question] = self._embedding_cache[question]
         
-        # Get embeddings
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            embeddings = outputs.last_hidden_state.mean(dim=1)  # Average pooling
+        missing = list(dict.fromkeys(q for q in cleaned if q not in embeddings))
+        if missing:
+            import torch
+            
+            # Tokenize once without padding, then bucket by length
+            encoded = self.tokenizer(missing, truncation=True, max_length=max_length)['input_ids']
+            order = sorted(range(len(missing)), key=lambda i: len(encoded[i]))
+            
+            for start in range(0, len(order), batch_size):
+                bucket = order[start:start + batch_size]
+                inputs = self.tokenizer.pad(
+                    {'input_ids': [encoded[i] for i in bucket]}, padding=True, return_tensors='pt'
+                )
+                
+                with torch.no_grad():
+                    hidden = self.model(**inputs).last_hidden_state
+                    mask = inputs['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+                    pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)  # Masked average pooling
+                
+                for i, vector in zip(bucket, pooled.numpy()):
+                    embeddings[missing[i]] = vector
+            
+            with self._embedding_cache_lock:
+                for question in missing:
+                    self._embedding_cache[question] = embeddings[question]
+                while len(self._embedding_cache) > self.embedding_cache_size:
+                    self._embedding_cache.popitem(last=False)
         
-        return embeddings.squeeze().numpy()
+        if not cleaned:
+            return np.zeros((0, self.model.config.hidden_size), dtype=np.float32)
+        return np.stack([embeddings[q] for q in cleaned])
+    
+    def iter_question_embeddings(self, questions, chunk_size=1024, batch_size=32):
+        """
+        Embed a stream of questions (any iterable, e.g. read_questions(path))
+        chunk by chunk, yielding (question, embedding) pairs in order
+        """
+        questions = iter(questions)
+        while True:
+            chunk = list(itertools.islice(questions, chunk_size))
+            if not chunk:
+                return
+            yield from zip(chunk, self.embed_questions(chunk, batch_size=batch_size))
     
     def identify_question_type(self, question):
         """
         Identify the type of question for better answering
         """
-        question_lower = question.lower()
-        
-        # Question type mapping
-        question_types = {
-            'counting': ['how many', 'count', 'number of'],
-            'color': ['what color', 'color', 'colour'],
-            'existence': ['is there', 'are there', 'does', 'do', 'has'],
-            'location': ['where', 'which location', 'position'],
-            'description': ['what is', 'describe', 'what does']
-        }
-        
-        for q_type, keywords in question_types.items():
-            if any(keyword in question_lower for keyword in keywords):
-                return q_type
-        
-        return 'general'
+        return self.question_classifier.classify(question)
+    
+    def identify_question_types(self, questions):
+        """
+        Question types for a batch of questions (e.g. a whole query log)
+        """
+        return self.question_classifier.classify_batch(questions)
     
     def extract_keywords(self, question):
         """
         Extract important keywords from question
         """
         # Simple keyword extraction
-        stop_words = {'the', 'a', 'an', 'is', 'are', 'what', 'where', 'how', 'why', 'when'}
-        tokens = word_tokenize(question.lower())
-        keywords = [token for token in tokens if token not in stop_words and len(token) > 2]
+        tokens = TOKEN_PATTERN.findall(question.lower())
+        keywords = [token for token in tokens if token not in KEYWORD_STOP_WORDS and len(token) > 2]
         
-        return keywords
\ No newline at end of file
+        return keywords
+    
+    def extract_keywords_batch(self, questions):
+        """
+        Keywords for a batch of questions; repeated questions are tokenized once
+        """
+        seen = {}
+        results = []
+        for question in questions:
+            keywords = seen.get(question)
+            if keywords is None:
+                keywords = seen[question] = self.extract_keywords(question)
+            results.append(list(keywords))
+        return results
\ No newline at end of file
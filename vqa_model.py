@@ -1,82 +1,672 @@
 # models/vqa_model.py
-from transformers import ViltProcessor, ViltForQuestionAnswering
+from transformers import ViltConfig, ViltProcessor, ViltForQuestionAnswering
+import logging
+import os
+import threading
+import time
+from types import SimpleNamespace
 import torch
-from PIL import Image
 import requests
 
+from feature_cache import FeatureCache, config_fingerprint
+from image_io import load_image, image_content_hash
+from model_registry import get_registry
+from telemetry import get_telemetry
+
+logger = logging.getLogger(__name__)
+
+VILT_MODEL_NAME = "dandelin/vilt-b32-finetuned-vqa"
+
+# fp32: eager weights as published; int8: dynamic int8 quantization of the
+# Linear layers (CPU only); bf16: bfloat16 weights and activations
+PRECISIONS = ('fp32', 'int8', 'bf16')
+
+# torch: eager HF model; onnx: a graph written by export_vilt.py, run with
+# ONNX Runtime on CPU
+BACKENDS = ('torch', 'onnx')
+DEFAULT_ONNX_PATH = 'exports/vilt'
+
+# Temperatures tried by RealVQAModel.calibrate
+CALIBRATION_TEMPERATURES = tuple(round(0.5 + 0.1 * i, 1) for i in range(46))
+
+
+def cpu_supports_bf16():
+    """
+    True when the CPU has native bfloat16 instructions (AVX512-BF16 or AMX);
+    without them bf16 matmuls are emulated and slower than fp32
+    """
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def configure_threads(num_threads=None, num_interop_threads=None):
+    """
+    Set torch's intra-op and inter-op thread pools for this process. With
+    several workers per host, give each about cores / workers threads so
+    they don't oversubscribe the CPU.
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            # Only allowed before the first parallel op in the process
+            logger.warning("Could not set inter-op threads: %s", e)
+
+
+def fit_temperature(logits, labels, temperatures=CALIBRATION_TEMPERATURES):
+    """
+    Temperature scaling: the temperature that minimizes the negative
+    log-likelihood of the reference labels under softmax(logits / T)
+    """
+    losses = [torch.nn.functional.cross_entropy(logits / t, labels).item() for t in temperatures]
+    return temperatures[losses.index(min(losses))]
+
+
+def _load_vilt(device, precision='fp32'):
+    processor = ViltProcessor.from_pretrained(VILT_MODEL_NAME)
+    model = ViltForQuestionAnswering.from_pretrained(VILT_MODEL_NAME)
+    model.to(device)
+    model.eval()
+    if precision == 'int8':
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif precision == 'bf16':
+        model = model.to(torch.bfloat16)
+    return processor, model
+
+
+class OnnxViltModel:
+    """
+    Runs an exported ViLT graph with ONNX Runtime behind the same interface
+    as the eager model: model(**encoding).logits and model.config.id2label
+    """
+    def __init__(self, path, config, num_threads=None):
+        import onnxruntime as ort
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        # The exporter may drop inputs the graph doesn't use
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.config = config
+    
+    def __call__(self, **encoding):
+        feed = {name: encoding[name].cpu().numpy() for name in self.input_names}
+        logits = self.session.run(['logits'], feed)[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+def _load_vilt_onnx(export_dir, precision='fp32', num_threads=None):
+    filename = 'model.int8.onnx' if precision == 'int8' else 'model.onnx'
+    processor = ViltProcessor.from_pretrained(export_dir)
+    config = ViltConfig.from_pretrained(export_dir)
+    return processor, OnnxViltModel(os.path.join(export_dir, filename), config, num_threads)
+
 class RealVQAModel:
     """
     A real VQA model using pre-trained ViLT (Vision-and-Language Transformer)
     This actually understands images and questions!
     """
-    def __init__(self):
+    def __init__(self, max_batch_size=16, feature_cache=None, precision=None, num_threads=None,
+                 num_interop_threads=None, backend=None, onnx_path=None, top_k=None, temperature=None):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        print("Loading ViLT VQA model...")
+        self.max_batch_size = max_batch_size
+        
+        # The backend defaults to VQA_BACKEND; the ONNX export directory to VQA_ONNX_PATH
+        self.backend = backend or os.environ.get('VQA_BACKEND', 'torch')
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {self.backend!r}, expected one of {BACKENDS}")
+        self.onnx_path = onnx_path or os.environ.get('VQA_ONNX_PATH', DEFAULT_ONNX_PATH)
+        if self.backend == 'onnx':
+            self.device = torch.device('cpu')
+        self.num_threads = num_threads or int(os.environ.get('VQA_TORCH_THREADS', 0))
         
-        # Load pre-trained ViLT model - specifically trained for VQA
-        self.processor = ViltProcessor.from_pretrained("dandelin/vilt-b32-finetuned-vqa")
-        self.model = ViltForQuestionAnswering.from_pretrained("dandelin/vilt-b32-finetuned-vqa")
-        self.model.to(self.device)
-        self.model.eval()
+        # Precision and thread counts default to VQA_PRECISION,
+        # VQA_TORCH_THREADS and VQA_TORCH_INTEROP_THREADS
+        self.precision = self._resolve_precision(precision or os.environ.get('VQA_PRECISION', 'fp32'))
+        self.compute_dtype = torch.bfloat16 if self.precision == 'bf16' else torch.float32
+        configure_threads(
+            self.num_threads,
+            num_interop_threads or int(os.environ.get('VQA_TORCH_INTEROP_THREADS', 0))
+        )
+        self.feature_cache = feature_cache if feature_cache is not None else FeatureCache()
+        self.telemetry = get_telemetry()
         
-        print("ViLT model loaded successfully!")
+        # Answers come with the top_k most likely alternatives; confidences are
+        # softmax(logits / temperature), see calibrate(). VQA_TOP_K and
+        # VQA_TEMPERATURE set the defaults
+        self.top_k = top_k or int(os.environ.get('VQA_TOP_K', 5))
+        self.temperature = temperature or float(os.environ.get('VQA_TEMPERATURE', 1.0))
+        
+        # Weights are loaded on first use (or by an explicit load() warm-up)
+        self._processor = None
+        self._model = None
+        self._load_lock = threading.Lock()
+        self.load_seconds = None
     
-    def predict(self, image_path, question):
+    def load(self):
         """
-        Use real AI to answer questions about images
+        Load the processor and weights if they aren't loaded yet
         """
-        try:
-            # Load and prepare image
-            image = Image.open(image_path).convert('RGB')
+        with self._load_lock:
+            if self._model is not None:
+                return
+            
+            logger.info("Loading ViLT VQA model...")
+            start = time.perf_counter()
+            
+            # Load pre-trained ViLT model - specifically trained for VQA.
+            # The registry hands every RealVQAModel in the process the same weights
+            if self.backend == 'onnx':
+                factory = lambda: _load_vilt_onnx(self.onnx_path, self.precision, self.num_threads)
+            else:
+                factory = lambda: _load_vilt(self.device, self.precision)
+            processor, model = get_registry().get(self.registry_key, factory)
             
-            # Prepare inputs
-            encoding = self.processor(image, question, return_tensors="pt")
-            encoding = {k: v.to(self.device) for k, v in encoding.items()}
+            # Cache processed pixel inputs by image content; any change to the
+            # image processor config invalidates the cached tensors
+            self.feature_cache.configure('vilt_pixels', {
+                'model': VILT_MODEL_NAME,
+                'image_processor': processor.image_processor.to_dict()
+            })
+            
+            self._processor = processor
+            self._model = model
+            self.load_seconds = time.perf_counter() - start
+            logger.info("ViLT model loaded successfully in %.1fs (%s, %s)", self.load_seconds,
+                        self.backend, self.precision,
+                        extra={'load_seconds': self.load_seconds, 'backend': self.backend,
+                               'precision': self.precision})
+    
+    @property
+    def registry_key(self):
+        if self.backend == 'onnx':
+            return f"vilt-onnx:{os.path.abspath(self.onnx_path)}:{self.precision}"
+        return f"vilt:{VILT_MODEL_NAME}:{self.device}:{self.precision}"
+    
+    @property
+    def config_key(self):
+        """
+        The weights plus the settings that shape results (top_k, temperature)
+        """
+        return f"{self.registry_key}:top{self.top_k}:t{self.temperature:g}"
+    
+    def _resolve_precision(self, precision):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r}, expected one of {PRECISIONS}")
+        if precision == 'int8' and self.device.type != 'cpu':
+            # Dynamic quantization only has CPU kernels
+            logger.warning("int8 precision runs on CPU only; using cpu instead of %s", self.device)
+            self.device = torch.device('cpu')
+        if precision == 'bf16' and self.backend == 'onnx':
+            logger.warning("The ONNX backend has no bf16 graph; using fp32")
+            return 'fp32'
+        if precision == 'bf16' and self.device.type == 'cpu' and not cpu_supports_bf16():
+            logger.warning("CPU has no native bfloat16 support; using fp32")
+            return 'fp32'
+        return precision
+    
+    @property
+    def processor(self):
+        if self._model is None:
+            self.load()
+        return self._processor
+    
+    @property
+    def model(self):
+        if self._model is None:
+            self.load()
+        return self._model
+    
+    def predict(self, image, question, image_hash=None):
+        """
+        Use real AI to answer questions about images. image can be a path,
+        encoded bytes, a PIL image or an RGB array.
+        """
+        try:
+            # Prepare inputs (pixel values come from the feature cache when possible)
+            pixel_inputs = self._encode_image(image, image_hash)
+            with self.telemetry.span('vilt_tokenize'):
+                encoding = self._build_encoding([pixel_inputs], [question])
             
             # Forward pass
-            with torch.no_grad():
+            with self.telemetry.span('vilt_forward', batch_size=1), torch.inference_mode():
                 outputs = self.model(**encoding)
-                logits = outputs.logits
-                predicted_class = logits.argmax(-1).item()
-                confidence = torch.softmax(logits, dim=-1).max().item()
+                probabilities, classes = self._top_k(outputs.logits.float())
             
-            # Get predicted answer
-            answer = self.model.config.id2label[predicted_class]
+            return self._format_result(classes[0].tolist(), probabilities[0].tolist())
             
-            return {
-                'answer': answer,
-                'confidence': round(confidence * 100, 2),
-                'model': 'ViLT'
-            }
+        except Exception:
+            logger.exception("Error in real VQA model")
+            self.telemetry.increment('vqa_errors_total', stage='vilt')
+            return self._error_result()
+    
+    def predict_batch(self, pairs, max_batch_size=None):
+        """
+        Answer many (image, question) pairs with batched forward passes. A pair
+        may carry a precomputed content hash as a third item. Questions are
+        grouped by image so each image is processed once; results come back in
+        input order and match what predict returns per pair.
+        """
+        pairs = list(pairs)
+        results = [None] * len(pairs)
+        for indices, logits in self._batch_logits(pairs, max_batch_size):
+            if logits is None:
+                for index in indices:
+                    results[index] = self._error_result()
+                continue
+            probabilities, classes = self._top_k(logits)
+            for index, row_classes, row_probabilities in zip(indices, classes.tolist(), probabilities.tolist()):
+                results[index] = self._format_result(row_classes, row_probabilities)
+        
+        return results
+    
+    def predict_pixel_batch(self, pixel_inputs, questions):
+        """
+        Answer questions about already-processed images in one forward pass:
+        pixel_inputs[i] is the {'pixel_values', 'pixel_mask'} dict for the
+        image questions[i] asks about, as _encode_image builds it (e.g. read
+        back from a corpus index). Errors propagate to the caller.
+        """
+        with self.telemetry.span('vilt_tokenize'):
+            encoding = self._build_encoding(pixel_inputs, questions)
+        with self.telemetry.span('vilt_forward', batch_size=len(questions)), torch.inference_mode():
+            logits = self.model(**encoding).logits.float()
+        probabilities, classes = self._top_k(logits)
+        return [
+            self._format_result(row_classes, row_probabilities)
+            for row_classes, row_probabilities in zip(classes.tolist(), probabilities.tolist())
+        ]
+    
+    def calibrate(self, pairs, answers, temperatures=CALIBRATION_TEMPERATURES):
+        """
+        Fit the softmax temperature on held-out (image, question) pairs and
+        their reference answers (in the model's answer vocabulary), use it
+        for later predictions and return it. Pairs whose answer the model
+        can't produce are skipped.
+        """
+        pairs = list(pairs)
+        answers = list(answers)
+        label2id = self.model.config.label2id
+        rows = []
+        labels = []
+        for indices, logits in self._batch_logits(pairs):
+            if logits is None:
+                continue
+            for index, row in zip(indices, logits):
+                label = label2id.get(answers[index])
+                if label is not None:
+                    rows.append(row)
+                    labels.append(label)
+        if not rows:
+            raise ValueError("None of the calibration answers are in the model's answer vocabulary")
+        
+        self.temperature = fit_temperature(torch.stack(rows), torch.tensor(labels), temperatures)
+        logger.info("Calibrated ViLT temperature: %.2f on %d pairs", self.temperature, len(rows),
+                    extra={'temperature': self.temperature})
+        return self.temperature
+    
+    def _batch_logits(self, pairs, max_batch_size=None):
+        """
+        Yield (pair indices, fp32 logits) per forward pass over pairs, or
+        (pair indices, None) for pairs whose image or batch failed
+        """
+        batch_size = max_batch_size or self.max_batch_size
+        
+        # Group questions by image so each image is decoded once. Decoded
+        # images aren't hashable, so they are grouped by object identity
+        images = {}
+        questions_by_image = {}
+        for index, (image, question, *image_hash) in enumerate(pairs):
+            key = image if isinstance(image, str) else id(image)
+            images[key] = (image, image_hash[0] if image_hash else None)
+            questions_by_image.setdefault(key, []).append((index, question))
+        
+        pixel_inputs = {}
+        for key, items in questions_by_image.items():
+            try:
+                pixel_inputs[key] = self._encode_image(*images[key])
+            except Exception:
+                logger.exception("Error loading image %s", key)
+                self.telemetry.increment('vqa_errors_total', stage='vilt_preprocess')
+                yield [index for index, _ in items], None
+        
+        # Keep questions about the same image adjacent to minimize pixel padding
+        ordered = [
+            (index, key, question)
+            for key, items in questions_by_image.items() if key in pixel_inputs
+            for index, question in items
+        ]
+        
+        for start in range(0, len(ordered), batch_size):
+            chunk = ordered[start:start + batch_size]
+            try:
+                with self.telemetry.span('vilt_tokenize'):
+                    encoding = self._build_encoding(
+                        [pixel_inputs[key] for _, key, _ in chunk],
+                        [question for _, _, question in chunk]
+                    )
+                
+                with self.telemetry.span('vilt_forward', batch_size=len(chunk)), torch.inference_mode():
+                    logits = self.model(**encoding).logits.float()
             
-        except Exception as e:
-            print(f"Error in real VQA model: {e}")
-            return {
-                'answer': "I couldn't process that image and question",
-                'confidence': 0,
-                'model': 'ViLT'
-            }
+            except Exception:
+                logger.exception("Error in real VQA model batch")
+                self.telemetry.increment('vqa_errors_total', stage='vilt', value=len(chunk))
+                logits = None
+            
+            yield [index for index, _, _ in chunk], logits
+    
+    def _top_k(self, logits):
+        """
+        Temperature-scaled probabilities and classes of the top_k answers per
+        row. Only the k selected logits are normalized (against the
+        logsumexp of the row), so the full softmax is never materialized.
+        """
+        scaled = logits / self.temperature
+        values, classes = scaled.topk(min(self.top_k, scaled.shape[-1]), dim=-1)
+        probabilities = (values - torch.logsumexp(scaled, dim=-1, keepdim=True)).exp()
+        return probabilities, classes
+    
+    def _encode_image(self, image, image_hash=None):
+        """
+        Return the processor's pixel_values/pixel_mask for one image, reusing
+        cached tensors when the same image content was seen before
+        """
+        if image_hash is None:
+            image_hash = image_content_hash(image)
+        cached = self.feature_cache.get('vilt_pixels', image_hash)
+        if cached is not None:
+            return cached
+        
+        # The processor takes the RGB array directly, so no PIL round-trip
+        with self.telemetry.span('vilt_preprocess'):
+            pixels = self.processor.image_processor(load_image(image), return_tensors="pt")
+        pixel_inputs = {
+            'pixel_values': pixels['pixel_values'][0],
+            'pixel_mask': pixels['pixel_mask'][0]
+        }
+        self.feature_cache.put('vilt_pixels', image_hash, pixel_inputs)
+        return pixel_inputs
+    
+    def _build_encoding(self, pixel_inputs, questions):
+        """
+        Tokenize questions and pad per-image pixel tensors into one batch,
+        the same way ViltProcessor pads a list of images. Questions are cut
+        to ViLT's text positions, so one long question can't fail its batch.
+        """
+        encoding = dict(self.processor.tokenizer(
+            questions, padding=True, truncation=True,
+            max_length=self.model.config.max_position_embeddings, return_tensors="pt"
+        ))
+        
+        max_height = max(p['pixel_values'].shape[-2] for p in pixel_inputs)
+        max_width = max(p['pixel_values'].shape[-1] for p in pixel_inputs)
+        pixel_values = torch.zeros(len(pixel_inputs), 3, max_height, max_width,
+                                   dtype=pixel_inputs[0]['pixel_values'].dtype)
+        pixel_mask = torch.zeros(len(pixel_inputs), max_height, max_width,
+                                 dtype=pixel_inputs[0]['pixel_mask'].dtype)
+        for i, p in enumerate(pixel_inputs):
+            height, width = p['pixel_values'].shape[-2:]
+            pixel_values[i, :, :height, :width] = p['pixel_values']
+            pixel_mask[i, :height, :width] = p['pixel_mask'][:height, :width]
+        
+        encoding['pixel_values'] = pixel_values.to(self.compute_dtype)
+        encoding['pixel_mask'] = pixel_mask
+        return {k: v.to(self.device) for k, v in encoding.items()}
+    
+    def _format_result(self, classes, probabilities):
+        top_k = [
+            {'answer': self.model.config.id2label[predicted_class], 'confidence': round(probability * 100, 2)}
+            for predicted_class, probability in zip(classes, probabilities)
+        ]
+        return {
+            'answer': top_k[0]['answer'],
+            'confidence': top_k[0]['confidence'],
+            'top_k': top_k,
+            'model': 'ViLT'
+        }
+    
+    def _error_result(self):
+        return {
+            'answer': "I couldn't process that image and question",
+            'confidence': 0,
+            'model': 'ViLT',
+            'error': 'inference failed'
+        }
+
+def compare_precisions(pairs, precisions=PRECISIONS, reference='fp32', max_batch_size=16, backend='torch'):
+    """
+    Answer the same (image, question) fixture pairs at each precision and
+    report, per precision, answer agreement with the reference precision,
+    the mean confidence change and the forward-pass time per pair. Each
+    precision is timed on a second pass, after weights and pixel tensors
+    are loaded.
+    """
+    pairs = list(pairs)
+    results = {}
+    reference_answers = None
+    for precision in [reference] + [p for p in precisions if p != reference]:
+        model = RealVQAModel(max_batch_size=max_batch_size, precision=precision, backend=backend)
+        if model.precision != precision:
+            results[precision] = {'skipped': f"not supported here (ran as {model.precision})"}
+            continue
+        model.predict_batch(pairs)
+        start = time.perf_counter()
+        predictions = model.predict_batch(pairs)
+        seconds_per_pair = (time.perf_counter() - start) / max(len(pairs), 1)
+        
+        if reference_answers is None:
+            reference_answers = predictions
+        matches = [p['answer'] == r['answer'] for p, r in zip(predictions, reference_answers)]
+        deltas = [abs(p['confidence'] - r['confidence']) for p, r in zip(predictions, reference_answers)]
+        results[precision] = {
+            'agreement': round(100.0 * sum(matches) / max(len(matches), 1), 2),
+            'mean_confidence_delta': round(sum(deltas) / max(len(deltas), 1), 2),
+            'ms_per_pair': round(seconds_per_pair * 1000, 2),
+            'speedup': round(results[reference]['ms_per_pair'] / max(seconds_per_pair * 1000, 1e-9), 2)
+            if reference in results else 1.0
+        }
+        if precision != reference:
+            # Only one extra copy of the weights is resident at a time
+            get_registry().unload(model.registry_key)
+    return results
+
+class RoutingPolicy:
+    """
+    Per-request routing thresholds, as confidence percentages. threshold
+    applies to every question type without its own entry in thresholds.
+    A model answer below its threshold is escalated to the heavier model
+    (when one is configured); a cheap-path answer is only used at or above
+    cheap_threshold, unless the cheap model applies its own guards
+    (guarded = True, as FastPathAnswerer does). Defaults come from VQA_CONFIDENCE_THRESHOLD and
+    VQA_CHEAP_THRESHOLD.
+    """
+    def __init__(self, threshold=None, thresholds=None, cheap_threshold=None):
+        self.threshold = threshold if threshold is not None else float(
+            os.environ.get('VQA_CONFIDENCE_THRESHOLD', 30))
+        self.thresholds = dict(thresholds or {})
+        self.cheap_threshold = cheap_threshold if cheap_threshold is not None else float(
+            os.environ.get('VQA_CHEAP_THRESHOLD', 90))
+    
+    def threshold_for(self, question_type):
+        return self.thresholds.get(question_type, self.threshold)
 
 class HybridVQAModel:
     """
-    Hybrid approach: Try real AI first, fallback to rule-based
+    Hybrid approach: Try real AI first, fallback to rule-based.
+    
+    Every request is routed: a cheap answerer (if given) answers first and
+    is used when confident enough ('cheap'); otherwise ViLT answers
+    ('answer'), and answers below the routing threshold are re-run on the
+    escalation model, a heavier ViLT configuration, keeping whichever
+    answer is more confident ('escalate'). Rule-based answers are
+    'fallback'. Each result carries its 'route', and decisions are counted
+    in vqa_routing_decisions_total.
     """
-    def __init__(self):
-        try:
-            self.real_model = RealVQAModel()
-            self.use_real_model = True
-            print("Using real AI VQA model")
-        except Exception as e:
-            print(f"Failed to load real model: {e}")
-            self.use_real_model = False
-            print("Falling back to rule-based model")
-            from models.vqa_model import EnhancedRuleBasedVQA
-            self.rule_model = EnhancedRuleBasedVQA()
-    
-    def predict(self, image_analysis, question, question_type, image_path):
-        if self.use_real_model:
-            result = self.real_model.predict(image_path, question)
-            return result['answer']
-        else:
+    def __init__(self, feature_cache=None, routing=None, escalation_options=None, cheap_model=None,
+                 **model_options):
+        # Which backend to use is decided when the real model is first loaded;
+        # model_options (precision, thread counts, ...) go to RealVQAModel
+        self.real_model = RealVQAModel(feature_cache=feature_cache, **model_options)
+        self.use_real_model = None
+        self._backend_lock = threading.Lock()
+        
+        self.routing = routing or RoutingPolicy()
+        # cheap_model(image_analysis, question, question_type, image) returns
+        # a result dict with a confidence, or None when it can't answer. A
+        # cheap model with guarded = True only answers when its own guards
+        # hold, and its answers skip routing.cheap_threshold
+        self.cheap_model = cheap_model
+        
+        # Escalation options override model_options, e.g. {'precision': 'fp32'}
+        # behind an int8 model. VQA_ESCALATE_PRECISION / VQA_ESCALATE_BACKEND
+        # configure it from the environment
+        if escalation_options is None:
+            escalation_options = {
+                key: os.environ[name]
+                for key, name in (('precision', 'VQA_ESCALATE_PRECISION'), ('backend', 'VQA_ESCALATE_BACKEND'))
+                if os.environ.get(name)
+            }
+        self.escalation_model = None
+        if escalation_options:
+            self.escalation_model = RealVQAModel(feature_cache=feature_cache,
+                                                 **dict(model_options, **escalation_options))
+            if self.escalation_model.registry_key == self.real_model.registry_key:
+                logger.warning("Escalation model is the same as the primary model; not escalating")
+                self.escalation_model = None
+    
+    @property
+    def answer_fingerprint(self):
+        """
+        Fingerprint of the models, routing and cheap answerer behind this
+        model's answers. Answer cache keys include it, so workers sharing a
+        cache with other settings, or a model re-calibrated since, don't
+        read each other's answers.
+        """
+        return config_fingerprint({
+            'model': 'rule-based' if self.use_real_model is False else self.real_model.config_key,
+            'escalation': self.escalation_model.config_key if self.escalation_model is not None else None,
+            'routing': vars(self.routing),
+            'cheap_model': (type(self.cheap_model).__qualname__, getattr(self.cheap_model, '__dict__', None))
+            if self.cheap_model is not None else None
+        })
+    
+    def load(self):
+        """
+        Load the real model, falling back to rule-based if that fails
+        """
+        with self._backend_lock:
+            if self.use_real_model is not None:
+                return
+            try:
+                self.real_model.load()
+                self.use_real_model = True
+                logger.info("Using real AI VQA model")
+            except Exception as e:
+                logger.warning("Failed to load real model, falling back to rule-based model: %s", e)
+                from models.vqa_model import EnhancedRuleBasedVQA
+                self.rule_model = EnhancedRuleBasedVQA()
+                self.use_real_model = False
+    
+    @property
+    def load_seconds(self):
+        return self.real_model.load_seconds
+    
+    def predict(self, image_analysis, question, question_type, image):
+        return self.predict_details(image_analysis, question, question_type, image)['answer']
+    
+    def predict_details(self, image_analysis, question, question_type, image, image_hash=None):
+        """
+        Like predict, but return the full result dict with answer, confidence,
+        top-k alternatives and route
+        """
+        return self.predict_batch([(image_analysis, question, question_type, image, image_hash)])[0]
+    
+    def predict_batch(self, requests):
+        """
+        Answer a list of (image_analysis, question, question_type, image[, image_hash])
+        requests, returning a result dict with answer and confidence for each
+        """
+        if self.use_real_model is None:
+            self.load()
+        requests = list(requests)
+        results = [None] * len(requests)
+        
+        pending = []
+        for index, request in enumerate(requests):
+            cheap = self._cheap_result(*request[:4])
+            if cheap is not None:
+                results[index] = self._routed(cheap, 'cheap', request[2])
+            else:
+                pending.append(index)
+        if not pending:
+            return results
+        
+        if not self.use_real_model:
             # Fallback to rule-based
-            return self.rule_model.predict(image_analysis, question, question_type, image_path)
\ No newline at end of file
+            get_telemetry().increment('vqa_model_fallbacks_total', value=len(pending))
+            for index in pending:
+                image_analysis, question, question_type, image, *_ = requests[index]
+                results[index] = self._routed(
+                    self._rule_result(self.rule_model.predict(image_analysis, question, question_type, image)),
+                    'fallback', question_type
+                )
+            return results
+        
+        pairs = [(requests[index][3], requests[index][1], *requests[index][4:]) for index in pending]
+        predictions = self.real_model.predict_batch(pairs)
+        
+        escalate = []
+        for position, (index, prediction) in enumerate(zip(pending, predictions)):
+            question_type = requests[index][2]
+            if (self.escalation_model is not None and prediction.get('top_k')
+                    and prediction['confidence'] < self.routing.threshold_for(question_type)):
+                escalate.append(position)
+            else:
+                results[index] = self._routed(prediction, 'answer', question_type)
+        
+        if escalate:
+            escalated = self.escalation_model.predict_batch([pairs[position] for position in escalate])
+            for position, heavy in zip(escalate, escalated):
+                index = pending[position]
+                # A failed escalation has confidence 0 and never wins
+                best = heavy if heavy['confidence'] >= predictions[position]['confidence'] else predictions[position]
+                results[index] = self._routed(best, 'escalate', requests[index][2])
+        
+        return results
+    
+    def _cheap_result(self, image_analysis, question, question_type, image):
+        # Without the image analysis (still running, or timed out) there is no cheap answer
+        if self.cheap_model is None or image_analysis is None:
+            return None
+        try:
+            result = self.cheap_model(image_analysis, question, question_type, image)
+        except Exception:
+            logger.exception("Error in cheap answer path")
+            get_telemetry().increment('vqa_errors_total', stage='cheap_path')
+            return None
+        if result is None:
+            return None
+        guarded = getattr(self.cheap_model, 'guarded', False)
+        if not guarded and (result.get('confidence') or 0) < self.routing.cheap_threshold:
+            return None
+        return result
+    
+    def _routed(self, result, decision, question_type):
+        get_telemetry().increment('vqa_routing_decisions_total', decision=decision, question_type=question_type)
+        return dict(result, route=decision)
+    
+    def _rule_result(self, answer):
+        return {
+            'answer': answer,
+            'confidence': None,
+            'model': 'rule-based'
+        }
\ No newline at end of file
@@ -1,57 +1,494 @@
 # vqa_system.py (updated imports and class)
 import os
-import json
-import numpy as np
-from PIL import Image
+import logging
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import matplotlib.pyplot as plt
 
 from utils.image_processor import ImageProcessor
 from utils.text_processor import TextProcessor
 from models.vqa_model import HybridVQAModel  # Changed import
+from fast_path import FastPathAnswerer
+from scheduler import MicroBatchScheduler
+from feature_cache import FeatureCache
+from image_io import ingest_image, load_image, image_content_hash
+from answer_cache import AnswerCache
+from model_registry import get_registry
+from telemetry import get_telemetry
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimeoutError(TimeoutError):
+    """
+    A pipeline stage didn't finish within its configured timeout
+    """
+
+
+def _settle(future, result=None, exception=None):
+    # First outcome wins; returns False if the future was already resolved
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+        return True
+    except InvalidStateError:
+        return False
+
+
+def _then(future, fn):
+    """
+    A Future for fn(future.result()), resolved when future is
+    """
+    chained = Future()
+    
+    def done(source):
+        if source.exception() is not None:
+            _settle(chained, exception=source.exception())
+        else:
+            _settle(chained, fn(source.result()))
+    
+    future.add_done_callback(done)
+    return chained
 
 class VQASystem:
-    def __init__(self, use_real_model=True):  # Changed parameter
-        self.image_processor = ImageProcessor()
-        self.text_processor = TextProcessor()
+    def __init__(self, use_real_model=True, use_scheduler=False, scheduler_options=None,
+                 feature_cache_options=None, answer_cache=None, use_answer_cache=True,
+                 warmup=False, model_options=None, fast_path=None, concurrent_stages=None,
+                 stage_timeouts=None, stage_workers=4):  # Changed parameter
+        # Model weights are loaded lazily; these timings only cover construction
+        self.init_timings = {}
+        self.telemetry = get_telemetry()
+        
+        # One feature cache shared by the ResNet and ViLT image paths
+        self.feature_cache = FeatureCache(**(feature_cache_options or {}))
+        self.image_processor = self._timed_init('image_processor', ImageProcessor, feature_cache=self.feature_cache)
+        self.text_processor = self._timed_init('text_processor', TextProcessor)
         
         # Always use hybrid model now
-        self.vqa_model = HybridVQAModel()
-        print("VQA System initialized with AI model!")
+        # model_options, e.g. {'precision': 'int8', 'num_threads': 4}, configure ViLT
+        model_options = dict(model_options or {})
+        
+        # Questions the fast path can answer from the image analysis skip ViLT;
+        # it defaults to the answerers enabled by VQA_FAST_PATH (fast_path=False disables it)
+        if fast_path is None:
+            fast_path = FastPathAnswerer.from_env()
+        if fast_path:
+            model_options.setdefault('cheap_model', fast_path)
+        self.vqa_model = self._timed_init('vqa_model', HybridVQAModel, feature_cache=self.feature_cache,
+                                          **model_options)
+        
+        # concurrent_stages=True (or VQA_CONCURRENT_STAGES=1) runs the image
+        # analysis on a thread pool alongside inference. stage_timeouts gives
+        # 'image_analysis' and 'inference' timeouts in seconds (defaults:
+        # VQA_ANALYSIS_TIMEOUT, VQA_INFERENCE_TIMEOUT; none)
+        if concurrent_stages is None:
+            concurrent_stages = os.environ.get('VQA_CONCURRENT_STAGES') == '1'
+        self.concurrent_stages = concurrent_stages
+        self.stage_timeouts = dict(stage_timeouts or {})
+        for stage, name in (('image_analysis', 'VQA_ANALYSIS_TIMEOUT'), ('inference', 'VQA_INFERENCE_TIMEOUT')):
+            if stage not in self.stage_timeouts and os.environ.get(name):
+                self.stage_timeouts[stage] = float(os.environ[name])
+        # Analysis and timeout-bounded inference get separate pools, created
+        # on first use: an abandoned inference keeps its thread until the
+        # model returns, and must not hold up image analysis
+        self.stage_workers = stage_workers
+        self._stage_pools = {}
+        self._stage_pools_lock = threading.Lock()
+        
+        # Optional micro-batching so concurrent callers share forward passes
+        self.scheduler = None
+        if use_scheduler:
+            self.scheduler = MicroBatchScheduler(self.vqa_model.predict_batch, **(scheduler_options or {}))
+        
+        # Memoized answers keyed on image content and normalized question;
+        # pass an AnswerCache with a SQLite/Redis backend to share across workers
+        self.answer_cache = None
+        if use_answer_cache:
+            self.answer_cache = answer_cache if answer_cache is not None else AnswerCache()
+        
+        # warmup=True loads ViLT now; warmup='background' loads it on a thread
+        self._warmup_thread = None
+        if warmup == 'background':
+            self._warmup_thread = threading.Thread(target=self.warmup, name='vqa-warmup', daemon=True)
+            self._warmup_thread.start()
+        elif warmup:
+            self.warmup()
+        logger.info("VQA System initialized with AI model!")
+    
+    def _stage_pool(self, stage):
+        with self._stage_pools_lock:
+            pool = self._stage_pools.get(stage)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=self.stage_workers, thread_name_prefix=f'vqa-{stage}')
+                self._stage_pools[stage] = pool
+            return pool
+    
+    def close(self):
+        """
+        Stop the scheduler and any stage pools (running stages are not waited for)
+        """
+        if self.scheduler is not None:
+            self.scheduler.shutdown()
+        with self._stage_pools_lock:
+            pools, self._stage_pools = self._stage_pools, {}
+        for pool in pools.values():
+            pool.shutdown(wait=False)
+    
+    def _timed_init(self, name, factory, **kwargs):
+        start = time.perf_counter()
+        component = factory(**kwargs)
+        self.init_timings[name] = time.perf_counter() - start
+        return component
     
-    def process_input(self, image_path, question):
+    def warmup(self, components=('vqa_model',)):
         """
-        Process image and question to generate answer
+        Load model weights ahead of the first request. Only ViLT is needed by
+        process_input; add 'image_processor' or 'text_processor' to also load
+        ResNet50 or BERT.
         """
-        print(f"Processing image: {image_path}")
-        print(f"Question: {question}")
+        for name in components:
+            component = getattr(self, name)
+            if name == 'vqa_model':
+                component.load()
+            else:
+                component.model  # Accessing the property triggers the load
+    
+    def startup_timings(self):
+        """
+        Seconds spent constructing each component and loading its weights
+        (load is None until the model has been used or warmed up)
+        """
+        timings = {}
+        for name in ('image_processor', 'text_processor', 'vqa_model'):
+            load_seconds = getattr(self, name).load_seconds
+            timings[name] = {
+                'init': round(self.init_timings[name], 4),
+                'load': round(load_seconds, 4) if load_seconds is not None else None
+            }
+        return timings
+    
+    def memory_report(self):
+        """
+        Memory held by the models loaded in this process (shared by every
+        VQASystem instance)
+        """
+        return get_registry().memory_report()
+    
+    def metric_gauges(self):
+        """
+        Point-in-time scheduler, cache and memory values as (name, labels,
+        value) triples, for Telemetry.register_collector
+        """
+        gauges = []
+        if self.scheduler is not None:
+            snapshot = self.scheduler.metrics.snapshot()
+            gauges.append(('vqa_scheduler_queue_depth', {}, snapshot['queue_depth']))
+            for state in ('submitted', 'completed', 'rejected', 'timed_out', 'failed'):
+                gauges.append(('vqa_scheduler_requests', {'state': state}, snapshot[state]))
+        for name, value in self.feature_cache.stats().items():
+            gauges.append((f'vqa_feature_cache_{name}', {}, value))
+        if self.answer_cache is not None:
+            for name, value in self.answer_cache.stats().items():
+                gauges.append((f'vqa_answer_cache_{name}', {}, value))
+        memory = self.memory_report()
+        gauges.append(('vqa_process_rss_bytes', {}, memory['process_rss_bytes']))
+        for model, stats in memory['models'].items():
+            gauges.append(('vqa_model_parameter_bytes', {'model': model}, stats['parameter_bytes']))
+            gauges.append(('vqa_model_load_seconds', {'model': model}, stats['load_seconds']))
+        return gauges
+    
+    def process_input(self, image, question, image_hash=None, shape=None):
+        """
+        Process image and question to generate answer. image can be a file
+        path, encoded bytes, a PIL image or a decoded RGB array; it is decoded
+        once and the same pixel buffer is shared by every stage. Encoded
+        images are size-checked and decoded at bounded resolution
+        (image_io.ingest_image); ImageTooLargeError rejects oversized ones.
+        Callers that already decoded the image at reduced size pass the
+        original shape, which the results report.
+        
+        With concurrent_stages, the image analysis runs alongside inference
+        (see process_input_answer_first) and this waits for both.
+        """
+        if self.concurrent_stages:
+            results, image_analysis = self.process_input_answer_first(image, question, image_hash, shape)
+            results['image_analysis'] = image_analysis.result()
+            return results
+        
+        start = time.perf_counter()
+        telemetry = self.telemetry
+        logger.info("Processing image: %s", self._describe_image(image), extra={'question': question})
+        
+        # Hash the source before decoding (encoded bytes hash faster than pixels)
+        with telemetry.span('decode'):
+            if image_hash is None:
+                image_hash = image_content_hash(image)
+            image, ingested_shape = ingest_image(image)
+            shape = shape or ingested_shape
         
         # Step 1: Process image (for display purposes)
-        image_analysis = self.image_processor.simple_image_analysis(image_path)
+        with telemetry.span('image_analysis'):
+            image_analysis = self.image_processor.simple_image_analysis(image)
         
         # Step 2: Process question (for display purposes)
-        question_type = self.text_processor.identify_question_type(question)
-        keywords = self.text_processor.extract_keywords(question)
+        with telemetry.span('question_analysis'):
+            question_type = self.text_processor.identify_question_type(question)
+            keywords = self.text_processor.extract_keywords(question)
         
-        print(f"Question type: {question_type}")
-        print(f"Keywords: {keywords}")
+        logger.debug("Question analyzed", extra={'question_type': question_type, 'keywords': keywords})
         
-        # Step 3: Generate answer using REAL AI
-        answer = self.vqa_model.predict(image_analysis, question, question_type, image_path)
+        # Step 3: Generate answer using REAL AI, unless this exact question
+        # was already answered for this image
+        with telemetry.span('answer_cache'):
+            cache_key = self._answer_cache_key(image_hash, question)
+            prediction = self._cached_prediction(cache_key)
+        cached = prediction is not None
+        if not cached:
+            with telemetry.span('inference'):
+                prediction = self._run_inference(image_analysis, question, question_type, image, image_hash)
+            self._store_prediction(cache_key, prediction)
+        self._record_answer(prediction, start)
         
         # Step 4: Return results
         results = {
-            'answer': answer,
+            'answer': prediction['answer'],
+            'confidence': prediction['confidence'],
+            'top_k': prediction.get('top_k', []),
+            'route': prediction.get('route'),
+            'cached': cached,
             'question_type': question_type,
             'keywords': keywords,
-            'image_analysis': {
-                'shape': image_analysis.get('shape', 'unknown'),
-                'brightness': round(image_analysis.get('brightness', 0), 2)
-            }
+            'image_analysis': self._analysis_summary(image_analysis, shape)
         }
         
         return results
     
-    def display_results(self, image_path, question, results):
+    def process_input_answer_first(self, image, question, image_hash=None, shape=None):
+        """
+        process_input with the image analysis running on its own thread pool while
+        the answer is computed. Returns (results, image_analysis) as soon as
+        the answer is ready: results['image_analysis'] is None and
+        image_analysis is a Future for the summary process_input includes.
+        Inference only waits for the analysis when the fast path may answer
+        the question.
+        """
+        start = time.perf_counter()
+        telemetry = self.telemetry
+        logger.info("Processing image: %s", self._describe_image(image), extra={'question': question})
+        
+        with telemetry.span('decode'):
+            if image_hash is None:
+                image_hash = image_content_hash(image)
+            image, ingested_shape = ingest_image(image)
+            shape = shape or ingested_shape
+        analysis = self._start_analysis(image)
+        
+        with telemetry.span('question_analysis'):
+            question_type = self.text_processor.identify_question_type(question)
+            keywords = self.text_processor.extract_keywords(question)
+        
+        with telemetry.span('answer_cache'):
+            cache_key = self._answer_cache_key(image_hash, question)
+            prediction = self._cached_prediction(cache_key)
+        cached = prediction is not None
+        if not cached:
+            image_analysis = analysis.result() if self._fast_path_handles(question, question_type) else None
+            with telemetry.span('inference'):
+                prediction = self._run_inference(image_analysis, question, question_type, image, image_hash)
+            self._store_prediction(cache_key, prediction)
+        self._record_answer(prediction, start)
+        
+        results = {
+            'answer': prediction['answer'],
+            'confidence': prediction['confidence'],
+            'top_k': prediction.get('top_k', []),
+            'route': prediction.get('route'),
+            'cached': cached,
+            'question_type': question_type,
+            'keywords': keywords,
+            'image_analysis': None
+        }
+        return results, _then(analysis, lambda image_analysis: self._analysis_summary(image_analysis, shape))
+
+    def process_batch(self, image, questions, image_hash=None, shape=None):
+        """
+        Answer several questions about one image with a single batched model call
+        """
+        start = time.perf_counter()
+        telemetry = self.telemetry
+        logger.info("Processing image: %s (%d questions)", self._describe_image(image), len(questions))
+
+        with telemetry.span('decode'):
+            if image_hash is None:
+                image_hash = image_content_hash(image)
+            image, ingested_shape = ingest_image(image)
+            shape = shape or ingested_shape
+
+        # The image is analyzed once and shared by every question
+        with telemetry.span('image_analysis'):
+            image_analysis = self.image_processor.simple_image_analysis(image)
+
+        question_details = []
+        predictions = []
+        pending = []
+        for index, question in enumerate(questions):
+            with telemetry.span('question_analysis'):
+                question_type = self.text_processor.identify_question_type(question)
+                keywords = self.text_processor.extract_keywords(question)
+            question_details.append((question_type, keywords))
+
+            with telemetry.span('answer_cache'):
+                cache_key = self._answer_cache_key(image_hash, question)
+                prediction = self._cached_prediction(cache_key)
+            predictions.append(prediction)
+            if prediction is None:
+                pending.append((index, cache_key, (image_analysis, question, question_type, image, image_hash)))
+
+        # Only questions without a memoized answer go to the model
+        if pending:
+            with telemetry.span('inference', batch_size=len(pending)):
+                batch_predictions = self.vqa_model.predict_batch([request for _, _, request in pending])
+            for (index, cache_key, _), prediction in zip(pending, batch_predictions):
+                predictions[index] = prediction
+                self._store_prediction(cache_key, prediction)
+        computed = {index for index, _, _ in pending}
+        for prediction in predictions:
+            self._record_answer(prediction, start)
+
+        return [
+            {
+                'answer': prediction['answer'],
+                'confidence': prediction['confidence'],
+                'top_k': prediction.get('top_k', []),
+                'route': prediction.get('route'),
+                'cached': index not in computed,
+                'question_type': question_type,
+                'keywords': keywords,
+                'image_analysis': self._analysis_summary(image_analysis, shape)
+            }
+            for index, (prediction, (question_type, keywords)) in enumerate(zip(predictions, question_details))
+        ]
+
+    def _start_analysis(self, image):
+        """
+        Run simple_image_analysis on the analysis pool. The Future resolves to the
+        analysis, or to {'timed_out': True} if the image_analysis timeout
+        passes first, in which case the analysis stops at its next step.
+        """
+        cancel = threading.Event()
+        result = Future()
+        
+        def run():
+            if cancel.is_set():
+                return
+            try:
+                with self.telemetry.span('image_analysis'):
+                    analysis = self.image_processor.simple_image_analysis(image, cancel=cancel)
+            except Exception as e:
+                _settle(result, exception=e)
+            else:
+                _settle(result, analysis)
+        
+        self._stage_pool('analysis').submit(run)
+        
+        timeout = self.stage_timeouts.get('image_analysis')
+        if timeout:
+            def expire():
+                if _settle(result, {'timed_out': True}):
+                    cancel.set()
+                    self.telemetry.increment('vqa_stage_timeouts_total', stage='image_analysis')
+                    logger.warning("Image analysis took longer than %.2fs; answering without it", timeout)
+            
+            timer = threading.Timer(timeout, expire)
+            timer.daemon = True
+            timer.start()
+            result.add_done_callback(lambda _: timer.cancel())
+        return result
+    
+    def _fast_path_handles(self, question, question_type):
+        cheap_model = getattr(self.vqa_model, 'cheap_model', None)
+        if cheap_model is None:
+            return False
+        handles = getattr(cheap_model, 'handles', None)
+        return handles is None or handles(question, question_type)
+    
+    def _run_inference(self, image_analysis, question, question_type, image, image_hash):
+        """
+        One model prediction, through the scheduler when there is one, bounded
+        by the inference timeout. A timed-out request still waiting in the
+        scheduler queue is cancelled; one already on the model is abandoned.
+        """
+        timeout = self.stage_timeouts.get('inference')
+        if self.scheduler is not None:
+            future = self.scheduler.submit(image_analysis, question, question_type, image, image_hash)
+        elif timeout:
+            future = self._stage_pool('inference').submit(
+                self.vqa_model.predict_details, image_analysis, question, question_type, image, image_hash
+            )
+        else:
+            return self.vqa_model.predict_details(image_analysis, question, question_type, image, image_hash)
+        
+        try:
+            return future.result(timeout)
+        except (FutureTimeoutError, TimeoutError) as e:
+            self.telemetry.increment('vqa_stage_timeouts_total', stage='inference')
+            if future.done():
+                # The request itself failed with a timeout (expired in the scheduler queue)
+                raise StageTimeoutError(str(e)) from e
+            future.cancel()
+            raise StageTimeoutError(f"Inference took longer than {timeout}s")
+    
+    def _analysis_summary(self, image_analysis, shape=None):
+        # shape is the original image's; the analysis may have seen a reduced decode
+        summary = {
+            'shape': shape or image_analysis.get('shape', 'unknown'),
+            'brightness': round(image_analysis.get('brightness', 0), 2)
+        }
+        if image_analysis.get('timed_out'):
+            summary['timed_out'] = True
+        return summary
+    
+    def _describe_image(self, image):
+        if isinstance(image, str):
+            return image
+        return f"<{type(image).__name__}>"
+
+    def _answer_cache_key(self, image_hash, question):
+        if self.answer_cache is None:
+            return None
+        # Answers from a differently configured or re-calibrated model don't match
+        return image_hash, self.text_processor.preprocess_question(question), self.vqa_model.answer_fingerprint
+
+    def _cached_prediction(self, cache_key):
+        if cache_key is None:
+            return None
+        prediction = self.answer_cache.get(*cache_key)
+        self.telemetry.increment('vqa_answer_cache_requests_total', result='miss' if prediction is None else 'hit')
+        return prediction
+
+    def _record_answer(self, prediction, start):
+        self.telemetry.observe('vqa_request_seconds', time.perf_counter() - start)
+        if prediction.get('confidence') is not None:
+            self.telemetry.observe('vqa_answer_confidence', prediction['confidence'])
+
+    def _store_prediction(self, cache_key, prediction):
+        # Failed and rule-based predictions carry no confidence and are not memoized
+        if cache_key is None or not prediction.get('confidence'):
+            return
+        image_hash, question, model_fingerprint = cache_key
+        value = {
+            'answer': prediction['answer'],
+            'confidence': prediction['confidence'],
+            'top_k': prediction.get('top_k', []),
+            'route': prediction.get('route')
+        }
+        self.answer_cache.set(image_hash, question, value, model_fingerprint)
+
+    def display_results(self, image, question, results):
         """
         Display the image, question, and answer
         """
@@ -59,8 +496,7 @@ class VQASystem:
         
         # Display image
         plt.subplot(2, 2, 1)
-        image = Image.open(image_path)
-        plt.imshow(image)
+        plt.imshow(load_image(image))
         plt.title("Input Image")
         plt.axis('off')
         
@@ -0,0 +1,360 @@
+# worker_pool.py
+"""
+Multi-process VQA inference for many-core hosts.
+
+    pool = WorkerPool(num_workers=8, model_options={'precision': 'int8'})
+    pool.start()
+    results = pool.submit(image_bytes, ["What color is the car?"]).result()
+
+The parent loads ViLT once, moves the weights to shared memory and freezes
+the garbage collector, then forks the workers, so every worker maps the
+same weight pages instead of holding its own copy. Each worker is pinned to
+its own slice of the CPUs and sets torch's thread count to match. Images
+travel through shared-memory segments; only the segment name, the
+questions and the results are pickled. A monitor thread restarts workers
+that die, and fails the requests they were running with WorkerCrashedError;
+with request_timeout (VQA_WORKER_TIMEOUT seconds) it also fails requests
+that run longer than that with WorkerTimeoutError.
+
+Don't run inference in the parent before start(): forking after torch has
+started its thread pools can deadlock the children.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from image_io import ImageDecodeError, ImageTooLargeError
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCrashedError(RuntimeError):
+    """
+    The worker process handling a request exited before answering it
+    """
+
+
+class WorkerTimeoutError(TimeoutError):
+    """
+    A worker didn't answer a request within the pool's request_timeout
+    """
+
+
+def split_cpus(num_workers, cpus=None):
+    """
+    Split the CPUs this process may use into num_workers contiguous sets
+    """
+    cpus = sorted(cpus if cpus is not None else os.sched_getaffinity(0))
+    num_workers = max(1, min(num_workers, len(cpus)))
+    size, extra = divmod(len(cpus), num_workers)
+    sets = []
+    start = 0
+    for index in range(num_workers):
+        end = start + size + (1 if index < extra else 0)
+        sets.append(cpus[start:end])
+        start = end
+    return sets
+
+
+def _attach(name):
+    # Workers only borrow the segment; the parent owns and unlinks it. Before
+    # Python 3.13 attaching also registers the name with the resource
+    # tracker, but forked workers share the parent's tracker, where that
+    # registration is a no-op, so the parent's unlink() still cleans up
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _worker_main(index, cpus, threads, system_options, tasks, results):
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    # Build the system after pinning so torch sizes its pools for this worker
+    from vqa_system import StageTimeoutError, VQASystem
+
+    options = dict(system_options)
+    options['model_options'] = dict(options.get('model_options') or {}, num_threads=threads)
+    system = VQASystem(**options)
+    results.put(('ready', index, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        request_id, image_spec, questions, many = task
+        segment = None
+        try:
+            if image_spec[0] == 'shm':
+                _, name, size, shape, dtype = image_spec
+                segment = _attach(name)
+                if shape is None:
+                    image = segment.buf[:size]
+                else:
+                    image = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+            else:
+                image = image_spec[1]
+
+            if many:
+                answer = system.process_batch(image, questions)
+            else:
+                answer = system.process_input(image, questions[0])
+            results.put(('ok', request_id, answer))
+        except (ImageTooLargeError, ImageDecodeError, StageTimeoutError) as e:
+            # Errors callers map to a status code keep their type across the queue
+            results.put(('rejected', request_id, (type(e).__name__, str(e))))
+        except Exception as e:
+            results.put(('error', request_id, f"{type(e).__name__}: {e}"))
+        finally:
+            image = None
+            if segment is not None:
+                try:
+                    segment.close()
+                except BufferError:
+                    # A cache kept a view of the buffer; the mapping goes away with it
+                    pass
+
+
+def _rejection(name, message):
+    from vqa_system import StageTimeoutError
+
+    types = {cls.__name__: cls for cls in (ImageTooLargeError, ImageDecodeError, StageTimeoutError)}
+    return types.get(name, RuntimeError)(message)
+
+
+class _Worker:
+    def __init__(self, index, cpus, threads):
+        self.index = index
+        self.cpus = cpus
+        self.threads = threads
+        self.process = None
+        self.tasks = None
+        self.in_flight = set()
+        self.restarts = 0
+
+
+class WorkerPool:
+    """
+    Forked VQASystem workers behind a Future-based submit(). system_options
+    are passed to VQASystem in each worker; model_options (precision,
+    backend, ...) also decide which weights the parent preloads.
+    """
+    def __init__(self, num_workers=None, threads_per_worker=None, system_options=None,
+                 model_options=None, monitor_interval=1.0, request_timeout=None):
+        cpu_sets = split_cpus(num_workers or len(os.sched_getaffinity(0)))
+        self.workers = [
+            _Worker(index, cpus, threads_per_worker or len(cpus)) for index, cpus in enumerate(cpu_sets)
+        ]
+        self.system_options = dict(system_options or {}, model_options=model_options or {})
+        self.model_options = model_options or {}
+        self.monitor_interval = monitor_interval
+        # Checked by the monitor, so it is enforced to within monitor_interval
+        self.request_timeout = request_timeout or float(os.environ.get('VQA_WORKER_TIMEOUT', 0)) or None
+
+        self._context = multiprocessing.get_context('fork')
+        self._results = self._context.Queue()
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._request_ids = itertools.count()
+        self._ready = set()
+        self._running = False
+        self._threads = []
+
+    def start(self):
+        """
+        Preload the shared weights in the parent, then fork the workers
+        """
+        from model_registry import get_registry
+        from models.vqa_model import RealVQAModel
+
+        RealVQAModel(**self.model_options).load()
+        get_registry().prepare_for_fork()
+
+        # Start the shared-memory resource tracker before forking so the
+        # workers inherit it instead of each starting their own
+        resource_tracker.ensure_running()
+
+        self._running = True
+        for worker in self.workers:
+            self._spawn(worker)
+        for target, name in ((self._collect_results, 'vqa-pool-results'), (self._monitor, 'vqa-pool-monitor')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Started %d VQA workers", len(self.workers),
+                    extra={'cpu_sets': [w.cpus for w in self.workers]})
+        return self
+
+    def _spawn(self, worker):
+        worker.tasks = self._context.Queue()
+        worker.process = self._context.Process(
+            target=_worker_main,
+            args=(worker.index, worker.cpus, worker.threads, self.system_options, worker.tasks, self._results),
+            name=f'vqa-worker-{worker.index}',
+            daemon=True
+        )
+        worker.process.start()
+
+    def submit(self, image, questions, many=True):
+        """
+        Queue image (encoded bytes, an RGB array or a file path) and its
+        questions on the least-loaded worker. The Future resolves to
+        process_batch's list of results (or process_input's dict when
+        many=False).
+        """
+        if not self._running:
+            raise RuntimeError("WorkerPool is not running")
+        if isinstance(questions, str):
+            questions = [questions]
+
+        segment, image_spec = self._share_image(image)
+        future = Future()
+        request_id = next(self._request_ids)
+        deadline = time.monotonic() + self.request_timeout if self.request_timeout else None
+        with self._lock:
+            # The monitor swaps a dead worker's queue under this lock, so a
+            # task is either failed with the old queue or put on the new one
+            worker = min(self.workers, key=lambda w: len(w.in_flight))
+            worker.in_flight.add(request_id)
+            self._requests[request_id] = (future, segment, worker, deadline)
+            worker.tasks.put((request_id, image_spec, list(questions), many))
+        return future
+
+    def _share_image(self, image):
+        if isinstance(image, str):
+            return None, ('path', image)
+        if isinstance(image, np.ndarray):
+            image = np.ascontiguousarray(image)
+            segment = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+            np.ndarray(image.shape, dtype=image.dtype, buffer=segment.buf)[...] = image
+            return segment, ('shm', segment.name, image.nbytes, image.shape, image.dtype.str)
+
+        data = memoryview(image).cast('B')
+        segment = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        segment.buf[:len(data)] = data
+        return segment, ('shm', segment.name, len(data), None, None)
+
+    def _finish(self, request_id):
+        with self._lock:
+            return self._pop_request(request_id)
+
+    def _pop_request(self, request_id):
+        # Called with _lock held; the segment is released right away
+        entry = self._requests.pop(request_id, None)
+        if entry is None:
+            return None
+        future, segment, worker, _ = entry
+        worker.in_flight.discard(request_id)
+        if segment is not None:
+            segment.close()
+            segment.unlink()
+        return future
+
+    def _collect_results(self):
+        while self._running:
+            try:
+                status, key, payload = self._results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            if status == 'ready':
+                self._ready.add(key)
+                continue
+            future = self._finish(key)
+            if future is None:
+                continue
+            if status == 'ok':
+                future.set_result(payload)
+            elif status == 'rejected':
+                future.set_exception(_rejection(*payload))
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def _monitor(self):
+        while self._running:
+            time.sleep(self.monitor_interval)
+            for worker in self.workers:
+                if not self._running or worker.process.is_alive():
+                    continue
+                exitcode = worker.process.exitcode
+                logger.error("VQA worker %d exited with code %s; restarting", worker.index, exitcode)
+                self._ready.discard(worker.index)
+                # Fail the lost requests and swap in the new queue atomically,
+                # so submit() can't queue a task on the dead worker's queue
+                with self._lock:
+                    lost = [self._pop_request(request_id) for request_id in list(worker.in_flight)]
+                    worker.restarts += 1
+                    self._spawn(worker)
+                for future in lost:
+                    if future is not None:
+                        future.set_exception(WorkerCrashedError(
+                            f"Worker {worker.index} exited with code {exitcode}"
+                        ))
+            if self.request_timeout:
+                self._expire_requests()
+
+    def _expire_requests(self):
+        now = time.monotonic()
+        with self._lock:
+            overdue = [request_id for request_id, (_, _, _, deadline) in self._requests.items()
+                       if deadline is not None and deadline < now]
+            expired = [self._pop_request(request_id) for request_id in overdue]
+        for future in expired:
+            future.set_exception(WorkerTimeoutError(
+                f"No answer from the worker within {self.request_timeout}s"
+            ))
+
+    def ready(self):
+        """
+        True once every worker has built its VQASystem
+        """
+        return len(self._ready) == len(self.workers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': len(self.workers),
+                'ready': len(self._ready),
+                'in_flight': sum(len(w.in_flight) for w in self.workers),
+                'restarts': sum(w.restarts for w in self.workers),
+                'cpu_sets': [w.cpus for w in self.workers]
+            }
+
+    def metric_gauges(self):
+        """
+        (name, labels, value) triples for Telemetry.register_collector
+        """
+        gauges = [('vqa_pool_workers_ready', {}, len(self._ready))]
+        with self._lock:
+            for worker in self.workers:
+                labels = {'worker': worker.index}
+                gauges.append(('vqa_pool_in_flight', labels, len(worker.in_flight)))
+                gauges.append(('vqa_pool_restarts', labels, worker.restarts))
+        return gauges
+
+    def shutdown(self, timeout=10.0):
+        """
+        Stop the workers; requests still in flight fail with WorkerCrashedError
+        """
+        self._running = False
+        for worker in self.workers:
+            worker.tasks.put(None)
+        for worker in self.workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        with self._lock:
+            pending = list(self._requests)
+        for request_id in pending:
+            future = self._finish(request_id)
+            if future is not None:
+                future.set_exception(WorkerCrashedError("WorkerPool was shut down"))
\ No newline at end of file